@@ -5,3 +5,6 @@ class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
     verbose_name = 'API'
+
+    def ready(self):
+        from api import connections, signals  # noqa: F401
@@ -0,0 +1,143 @@
+"""Асинхронные представления для работы под ASGI.
+
+Синхронные представления Django 3.2 под ASGI выполняет через
+sync_to_async(thread_sensitive=True), то есть в одном общем потоке:
+пока один запрос ждёт БД, остальные стоят в очереди. Маршруты вьюсетов
+с AsyncViewSetMixin, ведущие к действиям из async_actions, получают
+асинхронную обёртку: запрос целиком (аутентификация, права, ORM,
+сериализация) выполняется в пуле из ASYNC_VIEWS['DB_THREADS'] потоков,
+а цикл событий тем временем принимает другие запросы. Размер пула
+заодно ограничивает число соединений воркера с БД.
+
+Асинхронного ORM в Django 3.2 нет, поэтому всё, что ходит в БД, идёт
+через пул. Прямо в цикле событий отдаются только ответы, готовые без
+БД: их возвращает fast_response() вьюсета, например попадания в кэш
+справочников (api.cache.ReferenceCacheMixin).
+
+Обёртка включается настройкой ASYNC_VIEWS['ENABLED']; под WSGI
+вьюсеты остаются синхронными.
+"""
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework.exceptions import APIException
+
+from .connections import check_connections
+from .metrics import Gauge, registry
+
+_executor = None
+_busy = 0
+_busy_lock = Lock()
+
+
+def get_async_settings():
+    return {
+        'ENABLED': False,
+        'DB_THREADS': 8,
+        **getattr(settings, 'ASYNC_VIEWS', {}),
+    }
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=get_async_settings()['DB_THREADS'],
+            thread_name_prefix='async-db',
+        )
+    return _executor
+
+
+def call_in_pool(func, *args, **kwargs):
+    global _busy
+    # Соединения потоков пула закрываются и проверяются по тем же
+    # правилам (CONN_MAX_AGE), что и соединения воркера между запросами.
+    close_old_connections()
+    check_connections()
+    with _busy_lock:
+        _busy += 1
+    try:
+        return func(*args, **kwargs)
+    finally:
+        with _busy_lock:
+            _busy -= 1
+        close_old_connections()
+
+
+def pool_state():
+    if _executor is None:
+        return {}
+    return {
+        ('threads',): get_async_settings()['DB_THREADS'],
+        ('busy',): _busy,
+    }
+
+
+registry.add_gauge(Gauge(
+    'foodgram_async_db_pool', 'Потоки пула асинхронных представлений.',
+    ('state',), pool_state))
+
+
+async def run_in_pool(func, *args, **kwargs):
+    """Выполняет синхронную func в пуле потоков для работы с БД."""
+    return await sync_to_async(
+        call_in_pool, thread_sensitive=False, executor=get_executor()
+    )(func, *args, **kwargs)
+
+
+class AsyncViewSetMixin:
+    """Асинхронные маршруты вьюсета для действий async_actions."""
+
+    async_actions = ('list', 'retrieve')
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+        if not get_async_settings()['ENABLED'] or not (
+                set(cls.async_actions) & set(actions.values())):
+            return view
+
+        @functools.wraps(view)
+        async def async_view(request, *args, **kwargs):
+            if request.method == 'GET':
+                response = cls.loop_response(
+                    actions, initkwargs, request, *args, **kwargs)
+                if response is not None:
+                    return response
+            return await run_in_pool(view, request, *args, **kwargs)
+
+        return async_view
+
+    @classmethod
+    def loop_response(cls, actions, initkwargs, request, *args, **kwargs):
+        """Ответ fast_response() с заголовками, как у обычной обработки
+        DRF, или None. Выполняется в цикле событий и не трогает БД:
+        пользователь не аутентифицируется, права не проверяются."""
+        self = cls(**initkwargs)
+        self.action_map = actions
+        for method, action in actions.items():
+            setattr(self, method, getattr(self, action))
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            self.format_kwarg = self.get_format_suffix(**kwargs)
+            (request.accepted_renderer,
+             request.accepted_media_type) = self.perform_content_negotiation(
+                request)
+        except APIException:
+            return None
+        response = self.fast_response(request)
+        if response is None:
+            return None
+        return self.finalize_response(request, response, *args, **kwargs)
+
+    def fast_response(self, request):
+        """Ответ, для которого не нужны ни БД, ни пользователь, или None."""
+        return None
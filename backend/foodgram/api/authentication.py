@@ -0,0 +1,86 @@
+"""Аутентификация без запроса к БД на каждый вызов API.
+
+TokenAuthentication из DRF на каждый запрос ищет Token вместе с User.
+CachedTokenAuthentication запоминает, какому пользователю принадлежит
+токен, а самого пользователя хранит отдельной записью, поэтому
+повторные запросы с тем же токеном в базу не ходят. Сигналы в
+api/signals.py удаляют запись токена при выходе (djoser удаляет Token)
+и запись пользователя при любом его сохранении или удалении, в том
+числе при деактивации, — следующий запрос снова проверит is_active.
+
+С AUTH_JWT_ENABLED доступны подписанные токены simplejwt
+(auth/jwt/create/). Подпись проверяется без БД, а пользователь берётся
+из той же записи кэша. Отозвать такой токен до истечения
+ACCESS_TOKEN_LIFETIME нельзя: выход удаляет только обычный токен.
+
+Хранилище задаётся настройкой AUTH_CACHE. В памяти процесса удаление
+записи видит только воркер, где оно произошло, остальные принимают
+токен до истечения timeout; общий бэкенд (DjangoCache) снимает это
+ограничение.
+"""
+import copy
+import hashlib
+
+from rest_framework.authentication import TokenAuthentication
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from .cache import get_cache
+
+
+def get_auth_cache():
+    return get_cache('AUTH_CACHE')
+
+
+def token_key(key):
+    return f'token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def user_key(user_id):
+    return f'user:{user_id}'
+
+
+def cached_user(user_id):
+    """Копия пользователя из кэша: запрос не должен менять общий объект."""
+    user = get_auth_cache().get(user_key(user_id))
+    return None if user is None else copy.copy(user)
+
+
+def forget_token(key):
+    get_auth_cache().delete(token_key(key))
+
+
+def forget_user(user_id):
+    get_auth_cache().delete(user_key(user_id))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+
+    def authenticate_credentials(self, key):
+        cache = get_auth_cache()
+        user_id = cache.get(token_key(key))
+        user = None if user_id is None else cached_user(user_id)
+        if user is None:
+            user, token = super().authenticate_credentials(key)
+            cache.set_many({
+                token_key(key): user.pk,
+                user_key(user.pk): copy.copy(user),
+            })
+            return user, token
+        return user, self.get_model()(key=key, user=user)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWT simplejwt с пользователем из кэша AUTH_CACHE.
+
+    В токене id пользователя (USER_ID_FIELD по умолчанию id), так что
+    запись общая с CachedTokenAuthentication.
+    """
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(jwt_settings.USER_ID_CLAIM)
+        user = None if user_id is None else cached_user(user_id)
+        if user is None:
+            user = super().get_user(validated_token)
+            get_auth_cache().set(user_key(user.pk), copy.copy(user))
+        return user
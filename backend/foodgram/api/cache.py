@@ -0,0 +1,270 @@
+"""Кэш отрендеренных ответов для справочников (теги, ингредиенты).
+
+Ответ хранится в виде готовых JSON-байтов вместе с ETag. Ключ включает
+версию пространства имён, которую сигналы post_save/post_delete моделей
+увеличивают при любом изменении, поэтому устаревшие записи просто
+перестают читаться и вытесняются.
+
+Хранилище задаётся настройкой REFERENCE_CACHE: по умолчанию это LRU
+в памяти процесса с коротким временем жизни записей — версию там
+увеличивает только воркер, который записал изменение, и остальные
+воркеры отдают старый ответ до истечения timeout. Для нескольких
+воркеров без задержки нужен DjangoCache поверх общего бэкенда Django
+(Redis, Memcached и т.п.). Те же хранилища использует
+кэш представлений рецептов (настройка RECIPE_CACHE).
+"""
+import hashlib
+import time
+from collections import OrderedDict
+from functools import partial
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+from django.utils.module_loading import import_string
+
+
+class LocalLRUCache:
+    """LRU-кэш в памяти процесса; timeout — время жизни записи в секундах."""
+
+    def __init__(self, max_entries=512, timeout=None):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = Lock()
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        with self._lock:
+            found = {}
+            for key in keys:
+                if key not in self._entries:
+                    continue
+                expires, value = self._entries[key]
+                if expires is not None and expires <= now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = value
+            return found
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def set_many(self, mapping):
+        expires = None
+        if self.timeout is not None:
+            expires = time.monotonic() + self.timeout
+        with self._lock:
+            for key, value in mapping.items():
+                self._entries[key] = (expires, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def get_version(self, namespace):
+        return self._versions.get(namespace, 1)
+
+    def bump_version(self, namespace):
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, 1) + 1
+
+
+class DjangoCache:
+    """Хранилище поверх кэш-бэкенда Django, общее для всех воркеров."""
+
+    def __init__(self, alias='default', timeout=None, prefix='reference'):
+        self.alias = alias
+        self.timeout = timeout
+        self.prefix = prefix
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, key):
+        return self.cache.get(f'{self.prefix}:{key}')
+
+    def get_many(self, keys):
+        start = len(self.prefix) + 1
+        return {
+            key[start:]: value for key, value in self.cache.get_many(
+                [f'{self.prefix}:{key}' for key in keys]).items()
+        }
+
+    def set(self, key, value):
+        self.cache.set(f'{self.prefix}:{key}', value, self.timeout)
+
+    def set_many(self, mapping):
+        self.cache.set_many({
+            f'{self.prefix}:{key}': value for key, value in mapping.items()
+        }, self.timeout)
+
+    def delete(self, key):
+        self.cache.delete(f'{self.prefix}:{key}')
+
+    def get_version(self, namespace):
+        return self.cache.get_or_set(
+            f'{self.prefix}-version:{namespace}', 1, None)
+
+    def bump_version(self, namespace):
+        key = f'{self.prefix}-version:{namespace}'
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.set(key, 2, None)
+
+
+_caches = {}
+
+
+def get_cache(setting):
+    """Хранилище, описанное настройкой setting (BACKEND и OPTIONS)."""
+    if setting not in _caches:
+        config = getattr(settings, setting, {})
+        backend = import_string(
+            config.get('BACKEND', 'api.cache.LocalLRUCache'))
+        _caches[setting] = backend(**config.get('OPTIONS', {}))
+    return _caches[setting]
+
+
+def get_reference_cache():
+    return get_cache('REFERENCE_CACHE')
+
+
+def bump_reference_version(namespace):
+    get_reference_cache().bump_version(namespace)
+
+
+def etag_matches(request, etag):
+    """Слабое сравнение ETag с заголовком If-None-Match."""
+    tags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+    return '*' in tags or etag in (
+        tag[2:] if tag.startswith('W/') else tag for tag in tags)
+
+
+class ReferenceCacheMixin:
+    """Отдаёт list/retrieve из кэша отрендеренных JSON-ответов.
+
+    Вьюсет задаёт cache_namespace; ответы не в JSON (например,
+    browsable API) рендерятся как обычно.
+    """
+
+    cache_namespace = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, view, request, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            return view(request, *args, **kwargs)
+        cache = get_reference_cache()
+        key = self.cache_key(request, cache)
+        entry = cache.get(key)
+        if entry is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            content = request.accepted_renderer.render(
+                response.data, request.accepted_media_type,
+                self.get_renderer_context())
+            entry = (content, f'"{hashlib.md5(content).hexdigest()}"')
+            cache.set(key, entry)
+        return self.entry_response(request, entry)
+
+    def fast_response(self, request):
+        """Попадание в кэш для api.async_views.AsyncViewSetMixin.
+
+        Без аутентификации и проверки прав ответ можно отдать только
+        на запрос без учётных данных и только из кэша в памяти процесса:
+        обращение к общему кэшу блокировало бы цикл событий.
+        """
+        cache = get_reference_cache()
+        if (self.action not in ('list', 'retrieve')
+                or 'HTTP_AUTHORIZATION' in request.META
+                or request.accepted_renderer.format != 'json'
+                or not isinstance(cache, LocalLRUCache)):
+            return None
+        entry = cache.get(self.cache_key(request, cache))
+        if entry is None:
+            return None
+        return self.entry_response(request, entry)
+
+    def cache_key(self, request, cache):
+        version = cache.get_version(self.cache_namespace)
+        return f'{self.cache_namespace}:{version}:{request.get_full_path()}'
+
+    def entry_response(self, request, entry):
+        content, etag = entry
+        if etag_matches(request, etag):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(
+                content, content_type=request.accepted_renderer.media_type)
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, no_cache=True)
+        return response
+
+
+class ConditionalGetMixin:
+    """Условные GET для list/retrieve рецептов без сериализации данных.
+
+    Подмешивается перед SharedRepresentationMixin. ETag строится по уже
+    выбранной странице: версиям рецептов и авторов, счётчикам и флагам
+    пользователя (representation_state()) и по count/next/previous
+    пагинации, так что отдельных запросов по всей выборке нет. Если ETag
+    совпал, отдаётся 304. Last-Modified не отдаётся: счётчики и флаги
+    меняются без изменения updated_at. ETag включает id пользователя,
+    а в Vary добавляется Authorization.
+    """
+
+    def list_response(self, request, recipes, paginated):
+        state = {'recipes': self.representation_state(request, recipes)}
+        if paginated:
+            state['page'] = sorted(
+                (key, value)
+                for key, value in self.get_paginated_response([]).data.items()
+                if key != 'results'
+            )
+        return self.conditional_response(request, partial(
+            super().list_response, request, recipes, paginated), state)
+
+    def retrieve_response(self, request, recipe):
+        return self.conditional_response(
+            request, partial(super().retrieve_response, request, recipe),
+            {'recipe': self.representation_state(request, [recipe])})
+
+    def conditional_response(self, request, render, state):
+        etag = '"{}"'.format(hashlib.md5(
+            f'{request.get_full_path()}:{request.user.pk}:'
+            f'{sorted(state.items())}'.encode()
+        ).hexdigest())
+        if etag_matches(request, etag):
+            response = HttpResponseNotModified()
+        else:
+            response = render()
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Authorization',))
+        patch_cache_control(
+            response, no_cache=True,
+            **{'private' if request.user.is_authenticated else 'public': True}
+        )
+        return response
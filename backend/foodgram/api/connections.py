@@ -0,0 +1,70 @@
+"""Постоянные соединения с БД и их статистика.
+
+С CONN_MAX_AGE соединение живёт между запросами, и установка соединения
+(TCP, TLS, аутентификация) уходит из времени ответа. Но соединение,
+пролежавшее без дела, может оказаться разорванным: PostgreSQL или
+pgbouncer перезапустили, сработал таймаут простоя. Django 4.1 проверяет
+такие соединения перед повторным использованием (CONN_HEALTH_CHECKS),
+для Django 3.2 ту же проверку в начале запроса делает check_connections.
+
+Для /api/_metrics считаются открытые сейчас соединения процесса, все
+открытые за время работы и не прошедшие проверку. Доля запросов, которым
+пришлось открывать соединение, — foodgram_db_connections_opened_total
+к foodgram_http_requests_total.
+"""
+from threading import Lock
+from weakref import WeakSet
+
+import django
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from .metrics import Gauge, registry
+
+NATIVE_HEALTH_CHECKS = django.VERSION >= (4, 1)
+
+# Обёртки соединений всех потоков; соединение потока, который
+# завершился, уходит из множества вместе с обёрткой.
+_wrappers = WeakSet()
+_lock = Lock()
+
+
+@receiver(connection_created)
+def track_connection(sender, connection, **kwargs):
+    with _lock:
+        _wrappers.add(connection)
+    registry.count(registry.connections_opened, (connection.alias,))
+
+
+@receiver(request_started)
+def check_connections(**kwargs):
+    """Закрывает соединения текущего потока, которые нельзя
+    использовать повторно; новое откроется при первом запросе к БД."""
+    if NATIVE_HEALTH_CHECKS:
+        return
+    for connection in connections.all():
+        if (connection.connection is None
+                or connection.in_atomic_block
+                or not connection.settings_dict.get('CONN_HEALTH_CHECKS')):
+            continue
+        if not connection.is_usable():
+            registry.count(
+                registry.health_check_failures, (connection.alias,))
+            connection.close()
+
+
+def open_connections():
+    with _lock:
+        wrappers = list(_wrappers)
+    result = {}
+    for wrapper in wrappers:
+        if wrapper.connection is not None:
+            result[(wrapper.alias,)] = result.get((wrapper.alias,), 0) + 1
+    return result
+
+
+registry.add_gauge(Gauge(
+    'foodgram_db_connections_open', 'Открытые сейчас соединения с БД.',
+    ('alias',), open_connections))
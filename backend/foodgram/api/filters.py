@@ -1,24 +1,45 @@
 from django.contrib.auth import get_user_model
+from django.db.models import Subquery
 from django_filters.rest_framework import FilterSet, filters
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend, OrderingFilter
 
+from .pagination import LimitCursorPagination
+from recipes.fulltext import (add_headlines, search_recipes,
+                              with_ingredient_overlap)
 from recipes.models import Ingredient, Recipes, Tags
+from recipes.search import search_ingredients
 
 User = get_user_model()
 
 
 class IngredientFilter(FilterSet):
-    name = filters.CharFilter(field_name='name', lookup_expr='startswith')
+    name = filters.CharFilter(method='search_name')
 
     class Meta:
         model = Ingredient
         fields = ('name', )
 
+    def search_name(self, queryset, name, value):
+        return search_ingredients(queryset, value)
+
 
 class RecipeFilter(FilterSet):
+    """Фильтры рецептов без DISTINCT.
+
+    Теги отбираются полусоединением pk IN (SELECT recipes_id ...), его
+    ведёт индекс таблицы связей по tags_id, и рецепт с несколькими
+    подходящими тегами попадает в выдачу один раз. Избранное и корзина
+    соединяются напрямую: пара (пользователь, рецепт) в них уникальна,
+    строки рецептов не размножаются, а индекс (author, recipe) задаёт
+    порядок соединения.
+    """
+
     tags = filters.ModelMultipleChoiceFilter(
         field_name='tags__slug',
         to_field_name='slug',
         queryset=Tags.objects.all(),
+        method='filter_tags',
     )
 
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
@@ -29,13 +50,71 @@ class RecipeFilter(FilterSet):
         model = Recipes
         fields = ('tags', 'author')
 
+    def filter_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        return queryset.filter(pk__in=Subquery(
+            Recipes.tags.through.objects.filter(
+                tags__in=value).values('recipes_id')))
+
     def filter_is_favorited(self, queryset, name, value):
+        return self.filter_user_relation(queryset, 'favorite__author', value)
+
+    def get_is_in_shopping_cart(self, queryset, name, value):
+        return self.filter_user_relation(queryset, 'shop__author', value)
+
+    def filter_user_relation(self, queryset, lookup, value):
         user = self.request.user
         if value and not user.is_anonymous:
-            return queryset.filter(favorite__author=user)
+            return queryset.filter(**{lookup: user})
         return queryset
 
-    def get_is_in_shopping_cart(self, queryset, name, value):
-        if value:
-            return queryset.filter(shop__author=self.request.user)
+
+class RecipeSearchFilter(BaseFilterBackend):
+    """Полнотекстовый поиск (?search=) и подбор рецептов по имеющимся
+    ингредиентам (?ingredients=1,2,3).
+
+    Если ?ordering не передан, результаты сортируются по релевантности:
+    сначала по числу совпавших ингредиентов, затем по рангу поиска.
+    Пагинация по ключу (?cursor=) сортирует только по id и с такой
+    сортировкой не сочетается.
+    """
+
+    search_param = 'search'
+    ingredients_param = 'ingredients'
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        ingredients = self.get_ingredient_ids(request)
+        relevance = []
+        if ingredients:
+            queryset = with_ingredient_overlap(queryset, ingredients)
+            relevance += ['-matched_ingredients', 'missing_ingredients']
+        if query:
+            queryset = search_recipes(queryset, query)
+            relevance.append('-search_rank')
+        if relevance and OrderingFilter.ordering_param not in (
+                request.query_params):
+            if LimitCursorPagination.cursor_query_param in (
+                    request.query_params):
+                raise LimitCursorPagination.ordering_error()
+            queryset = queryset.order_by(*relevance, '-id')
         return queryset
+
+    def annotate_page(self, request, recipes, view):
+        """Фрагменты описания только для рецептов страницы."""
+        query = request.query_params.get(self.search_param, '').strip()
+        if query and recipes:
+            add_headlines(recipes, query, using=recipes[0]._state.db)
+
+    def get_ingredient_ids(self, request):
+        values = [
+            value
+            for param in request.query_params.getlist(self.ingredients_param)
+            for value in param.split(',') if value.strip()
+        ]
+        try:
+            return {int(value) for value in values}
+        except ValueError:
+            raise ValidationError(
+                {self.ingredients_param: 'Ожидаются id ингредиентов.'})
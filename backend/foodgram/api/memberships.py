@@ -0,0 +1,84 @@
+"""Кэш принадлежности: какие рецепты у пользователя в избранном и
+корзине и на каких авторов он подписан.
+
+Множества id загружаются при первом обращении одним запросом на все
+недостающие виды, так что флаги на страницах списков не ходят в базу.
+После коммита изменения Favorite, ShopCart или Follow множество этого
+вида просто удаляется из кэша и при следующем обращении читается
+заново: правка закэшированного значения на месте теряла бы
+параллельные изменения. Множества нужны только для представления —
+добавлено ли уже, решает запрос к базе. Хранилище задаётся настройкой
+MEMBERSHIP_CACHE; для нескольких воркеров нужен общий бэкенд
+(DjangoCache), а timeout ограничивает жизнь множеств в остальных.
+"""
+from collections import namedtuple
+
+from django.db import transaction
+from django.db.models import CharField, Value
+
+from .cache import get_cache
+from recipes.models import Favorite, ShopCart
+from users.models import Follow
+
+# Вид множества: модель, поле владельца и поле id в множестве.
+SOURCES = {
+    'favorites': (Favorite, 'author_id', 'recipe_id'),
+    'shop_cart': (ShopCart, 'author_id', 'recipe_id'),
+    'follows': (Follow, 'user_id', 'author_id'),
+}
+MODEL_KINDS = {model: kind for kind, (model, _, _) in SOURCES.items()}
+
+Memberships = namedtuple('Memberships', SOURCES)
+EMPTY = Memberships(*(frozenset() for _ in SOURCES))
+
+
+def get_membership_cache():
+    return get_cache('MEMBERSHIP_CACHE')
+
+
+def cache_key(kind, user_id):
+    return f'memberships:{kind}:{user_id}'
+
+
+def load_memberships(user_id, kinds):
+    sets = {kind: set() for kind in kinds}
+    querysets = []
+    for kind in kinds:
+        model, owner, target = SOURCES[kind]
+        querysets.append(model.objects.filter(**{owner: user_id}).annotate(
+            kind=Value(kind, output_field=CharField())
+        ).values_list('kind', target))
+    for kind, pk in querysets[0].union(*querysets[1:], all=True):
+        sets[kind].add(pk)
+    return {kind: frozenset(ids) for kind, ids in sets.items()}
+
+
+def get_memberships(user):
+    """Множества id избранного, корзины и подписок пользователя."""
+    if user.is_anonymous:
+        return EMPTY
+    cache = get_membership_cache()
+    keys = {kind: cache_key(kind, user.pk) for kind in SOURCES}
+    found = cache.get_many(keys.values())
+    missing = [kind for kind, key in keys.items() if key not in found]
+    if missing:
+        loaded = {
+            keys[kind]: ids
+            for kind, ids in load_memberships(user.pk, missing).items()
+        }
+        cache.set_many(loaded)
+        found.update(loaded)
+    return Memberships(**{kind: found[key] for kind, key in keys.items()})
+
+
+def invalidate_memberships(model, user_id):
+    """Сбрасывает множество пользователя для модели после коммита."""
+    key = cache_key(MODEL_KINDS[model], user_id)
+    transaction.on_commit(lambda: get_membership_cache().delete(key))
+
+
+def track_membership(instance):
+    """Сброс по сохранённой или удалённой строке модели."""
+    model = type(instance)
+    _, owner, _ = SOURCES[MODEL_KINDS[model]]
+    invalidate_memberships(model, getattr(instance, owner))
@@ -0,0 +1,335 @@
+"""Метрики запросов к API в текстовом формате Prometheus.
+
+MetricsMiddleware для каждого запроса замеряет время ответа, число
+запросов к БД и их суммарное время (обёртка count_queries в
+execute_wrappers соединений) и время рендеринга ответа. Если
+представление превысило бюджет запросов к БД, пишется предупреждение —
+так регрессии N+1 видны сразу.
+Метрики отдаются по адресу /api/_metrics.
+
+Настройка METRICS: ENABLED (по умолчанию выключено; выключенный
+middleware Django убирает из цепочки целиком), QUERY_BUDGET и
+ALLOWED_IPS для страницы метрик. С пустым ALLOWED_IPS страница
+недоступна никому. За nginx REMOTE_ADDR — всегда адрес прокси, поэтому
+снаружи путь закрыт в infra/nginx.conf, а Prometheus обращается
+к backend:8000 напрямую из сети docker.
+Метрики хранятся в памяти процесса, так что каждый воркер отдаёт свои.
+Статистику соединений с БД добавляет api.connections.
+
+Замер текущего запроса лежит в contextvar, а обёртка ставится на
+соединения всех потоков: при открытии соединения (connection_created)
+и в начале запроса (request_started, в потоке, где Django выполняет
+синхронные представления). Поэтому под ASGI учитываются запросы
+и синхронных представлений из sync_to_async, и пула api.async_views.
+"""
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from threading import Lock
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def get_metrics_settings():
+    return {
+        'ENABLED': False,
+        'QUERY_BUDGET': 20,
+        'ALLOWED_IPS': (),
+        **getattr(settings, 'METRICS', {}),
+    }
+
+
+def format_labels(names, values):
+    return ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace(
+            '"', '\\"'))
+        for name, value in zip(names, values)
+    )
+
+
+class Histogram:
+
+    def __init__(self, name, documentation, labels, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, labels, value):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [
+                [0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, (counts, total) in sorted(self._series.items()):
+            label_text = format_labels(self.labels, labels)
+            cumulative = 0
+            for bound, count in zip(
+                    (*self.buckets, '+Inf'), counts):
+                cumulative += count
+                yield (f'{self.name}_bucket{{{label_text},le="{bound}"}} '
+                       f'{cumulative}')
+            yield f'{self.name}_sum{{{label_text}}} {total}'
+            yield f'{self.name}_count{{{label_text}}} {cumulative}'
+
+
+class Counter:
+
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._series = {}
+
+    def inc(self, labels, value=1):
+        self._series[labels] = self._series.get(labels, 0) + value
+
+    def render(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        for labels, value in sorted(self._series.items()):
+            yield (f'{self.name}{{{format_labels(self.labels, labels)}}} '
+                   f'{value}')
+
+
+class Gauge:
+    """Значения считываются функцией collect при каждом рендеринге."""
+
+    def __init__(self, name, documentation, labels, collect):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.collect = collect
+
+    def render(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} gauge'
+        for labels, value in sorted(self.collect().items()):
+            yield (f'{self.name}{{{format_labels(self.labels, labels)}}} '
+                   f'{value}')
+
+
+class Registry:
+
+    def __init__(self):
+        self._lock = Lock()
+        self.requests = Counter(
+            'foodgram_http_requests_total', 'Запросы к API.',
+            ('view', 'method', 'status'))
+        self.latency = Histogram(
+            'foodgram_http_request_duration_seconds',
+            'Время ответа.', ('view', 'method'), LATENCY_BUCKETS)
+        self.queries = Histogram(
+            'foodgram_db_queries_per_request',
+            'Число запросов к БД на запрос.', ('view', 'method'),
+            QUERY_BUCKETS)
+        self.sql_time = Counter(
+            'foodgram_db_query_seconds_total',
+            'Суммарное время запросов к БД.', ('view', 'method'))
+        self.render_time = Histogram(
+            'foodgram_render_duration_seconds',
+            'Время рендеринга ответа.', ('view', 'method'),
+            LATENCY_BUCKETS)
+        self.over_budget = Counter(
+            'foodgram_query_budget_exceeded_total',
+            'Запросы, превысившие бюджет запросов к БД.',
+            ('view', 'method'))
+        self.connections_opened = Counter(
+            'foodgram_db_connections_opened_total',
+            'Открытые соединения с БД.', ('alias',))
+        self.health_check_failures = Counter(
+            'foodgram_db_connection_health_check_failures_total',
+            'Соединения, не прошедшие проверку перед повторным '
+            'использованием.', ('alias',))
+        self.gauges = []
+
+    def count(self, counter, labels):
+        with self._lock:
+            counter.inc(labels)
+
+    def add_query(self, sample, duration):
+        # Запросы одного замера могут идти из нескольких потоков пула.
+        with self._lock:
+            sample.query_count += 1
+            sample.sql_time += duration
+
+    def add_gauge(self, gauge):
+        with self._lock:
+            self.gauges.append(gauge)
+
+    def record(self, sample):
+        labels = (sample.view, sample.method)
+        with self._lock:
+            self.requests.inc((*labels, sample.status))
+            self.latency.observe(labels, sample.duration)
+            self.queries.observe(labels, sample.query_count)
+            self.sql_time.inc(labels, sample.sql_time)
+            if sample.render_time is not None:
+                self.render_time.observe(labels, sample.render_time)
+            if sample.over_budget:
+                self.over_budget.inc(labels)
+
+    def render(self):
+        with self._lock:
+            lines = [
+                line
+                for metric in (self.requests, self.latency, self.queries,
+                               self.sql_time, self.render_time,
+                               self.over_budget, self.connections_opened,
+                               self.health_check_failures, *self.gauges)
+                for line in metric.render()
+            ]
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+current_sample = ContextVar('metrics_sample', default=None)
+
+
+def count_queries(execute, sql, params, many, context):
+    """Считает запрос к БД в замер запроса, в контексте которого он
+    выполняется; вне запроса ничего не делает."""
+    sample = current_sample.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        registry.add_query(sample, time.perf_counter() - started)
+
+
+def install_query_counter(connection):
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+def on_connection_created(connection, **kwargs):
+    install_query_counter(connection)
+
+
+def on_request_started(**kwargs):
+    for connection in connections.all():
+        install_query_counter(connection)
+
+
+class RequestSample:
+    """Замеры одного запроса."""
+
+    def __init__(self, request):
+        self.method = request.method
+        self.view = 'unresolved'
+        self.status = None
+        self.started = None
+        self.duration = 0.0
+        self.query_count = 0
+        self.sql_time = 0.0
+        self.render_started = None
+        self.render_time = None
+        self.over_budget = False
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = get_metrics_settings()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.query_budget = config['QUERY_BUDGET']
+        connection_created.connect(
+            on_connection_created, dispatch_uid='metrics_query_counter')
+        request_started.connect(
+            on_request_started, dispatch_uid='metrics_query_counter')
+        if asyncio.iscoroutinefunction(get_response):
+            # Как в django.utils.deprecation.MiddlewareMixin.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+            # Иначе Django вызывал бы метод через sync_to_async.
+            self.process_template_response = self.aprocess_template_response
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        sample = self.start(request)
+        token = current_sample.set(sample)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_sample.reset(token)
+        return self.finish(request, sample, response)
+
+    async def __acall__(self, request):
+        sample = self.start(request)
+        token = current_sample.set(sample)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_sample.reset(token)
+        return self.finish(request, sample, response)
+
+    def start(self, request):
+        sample = request.metrics_sample = RequestSample(request)
+        sample.started = time.perf_counter()
+        return sample
+
+    def finish(self, request, sample, response):
+        sample.duration = time.perf_counter() - sample.started
+        sample.status = response.status_code
+        match = request.resolver_match
+        if match is not None:
+            sample.view = match.view_name
+        if self.query_budget is not None and (
+                sample.query_count > self.query_budget):
+            sample.over_budget = True
+            logger.warning(
+                '%s %s: %d запросов к БД при бюджете %d',
+                sample.method, sample.view, sample.query_count,
+                self.query_budget)
+        registry.record(sample)
+        return response
+
+    def process_template_response(self, request, response):
+        # Ответы DRF рендерятся после представления.
+        sample = request.metrics_sample
+        sample.render_started = time.perf_counter()
+
+        def rendered(response):
+            sample.render_time = time.perf_counter() - sample.render_started
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    async def aprocess_template_response(self, request, response):
+        return MetricsMiddleware.process_template_response(
+            self, request, response)
+
+
+def metrics_view(request):
+    config = get_metrics_settings()
+    if not config['ENABLED']:
+        raise Http404
+    if request.META.get('REMOTE_ADDR') not in config['ALLOWED_IPS']:
+        return HttpResponseForbidden()
+    return HttpResponse(
+        registry.render(), content_type='text/plain; version=0.0.4')
@@ -1,5 +1,7 @@
 from rest_framework import mixins, viewsets
 
+from .pagination import LimitCursorPagination
+
 
 class ListRetrieve(mixins.RetrieveModelMixin,
                    mixins.ListModelMixin, viewsets.GenericViewSet):
@@ -9,3 +11,18 @@ class ListRetrieve(mixins.RetrieveModelMixin,
 class CreateDestroy(mixins.CreateModelMixin,
                     mixins.DestroyModelMixin, viewsets.GenericViewSet):
     ...
+
+
+class CursorPaginationMixin:
+    """Включает пагинацию по ключу, если в запросе передан ?cursor=."""
+
+    cursor_pagination_class = LimitCursorPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator') and (
+            self.cursor_pagination_class.cursor_query_param
+            in self.request.query_params
+        ):
+            self._paginator = self.cursor_pagination_class()
+        return super().paginator
@@ -1,6 +1,66 @@
-from rest_framework.pagination import PageNumberPagination
+from collections import OrderedDict
+
+from django.db import connections
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
 
 
 class LimitPagination(PageNumberPagination):
     page_size = 6
     page_size_query_param = 'limit'
+
+
+class LimitCursorPagination(CursorPagination):
+    """Пагинация по ключу (?cursor=) без COUNT(*) и OFFSET.
+
+    Общее число записей считается только по запросу ?count=approximate,
+    на PostgreSQL — по оценке планировщика. Позиция курсора — значение
+    первого поля сортировки, поэтому сортировка возможна только по id:
+    счётчики не уникальны и меняются между страницами.
+    """
+
+    page_size = LimitPagination.page_size
+    page_size_query_param = 'limit'
+    ordering = '-id'
+    count_query_param = 'count'
+    cursor_orderings = ('id', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get(self.count_query_param) == 'approximate':
+            self.count = approximate_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if ordering[0] not in self.cursor_orderings:
+            raise self.ordering_error()
+        return ordering
+
+    @classmethod
+    def ordering_error(cls):
+        return ValidationError({cls.cursor_query_param: (
+            'Пагинация по ключу работает только с сортировкой по id, '
+            'используйте ?page= или ?ordering=-id.')})
+
+    def get_paginated_response(self, data):
+        payload = OrderedDict()
+        if self.count is not None:
+            payload['count'] = self.count
+        payload['next'] = self.get_next_link()
+        payload['previous'] = self.get_previous_link()
+        payload['results'] = data
+        return Response(payload)
+
+
+def approximate_count(queryset):
+    """Оценка числа строк из EXPLAIN на PostgreSQL, иначе точный COUNT."""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    return plan[0]['Plan']['Plan Rows']
@@ -8,7 +8,7 @@ class IsAuthorOrReadOnly(BasePermission):
                 or request.user.is_authenticated)
 
     def has_object_permission(self, request, view, obj):
-        return obj.author == request.user
+        return obj.author_id == request.user.pk
 
 
 class IsAdminOrReadOnly(BasePermission):
@@ -0,0 +1,74 @@
+import csv
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+SHOPPING_LIST_FOOTER = 'Удачные покупки только с Foodgram:)'
+
+
+class Echo:
+    """Буфер-заглушка: csv.writer сразу отдаёт записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """Базовый рендерер выгрузки списка покупок.
+
+    Список отдаётся потоком через stream(), render() нужен только
+    для ответов с ошибками.
+    """
+
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, ensure_ascii=False).encode(self.charset)
+
+    def stream(self, ingredients, user):
+        raise NotImplementedError
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients, user):
+        yield f'Список покупок для : {user.username}\n'
+        for num, ingred in enumerate(ingredients):
+            yield (
+                f'{"; " if num else ""}'
+                f'\n* {ingred["ingredient__name"]} — {ingred["amount"]} '
+                f'{ingred["ingredient__measurement_unit"]}'
+            )
+        yield f' \n\n{SHOPPING_LIST_FOOTER}'
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, ingredients, user):
+        writer = csv.writer(Echo())
+        yield writer.writerow(('name', 'measurement_unit', 'amount'))
+        for ingred in ingredients:
+            yield writer.writerow((
+                ingred['ingredient__name'],
+                ingred['ingredient__measurement_unit'],
+                ingred['amount'],
+            ))
+
+
+class ShoppingListJSONRenderer(JSONRenderer):
+    charset = 'utf-8'
+
+    def stream(self, ingredients, user):
+        yield '['
+        for num, ingred in enumerate(ingredients):
+            item = json.dumps({
+                'name': ingred['ingredient__name'],
+                'measurement_unit': ingred['ingredient__measurement_unit'],
+                'amount': ingred['amount'],
+            }, ensure_ascii=False)
+            yield f'{"," if num else ""}{item}'
+        yield ']'
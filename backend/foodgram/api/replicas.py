@@ -0,0 +1,129 @@
+"""Чтение с реплик БД для безопасных запросов.
+
+ReplicaMiddleware выбирает для запроса с безопасным методом (GET, HEAD,
+OPTIONS) одну из реплик из настройки DATABASE_REPLICAS['ALIASES'],
+и ReplicaRouter направляет туда все чтения ORM этого запроса. Запись
+и все запросы с остальными методами идут в основную БД.
+
+Реплика отстаёт от основной БД, поэтому после записи клиент
+STICKY_SECONDS секунд читает из основной БД и видит свои изменения.
+Такой клиент узнаётся по cookie, которую ставит ответ на запрос
+с записью, а клиент без cookie — по заголовку Authorization
+(хранилище REPLICA_PINS, по умолчанию в памяти процесса).
+
+Для проверки на одной машине достаточно двух баз SQLite: в DATABASES
+описать default и, например, replica с другим файлом, а в
+DATABASE_REPLICAS['ALIASES'] указать ['replica'].
+"""
+import asyncio
+import hashlib
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from rest_framework.permissions import SAFE_METHODS
+
+from .cache import get_cache
+
+# Реплика для чтений текущего запроса; None — основная БД.
+read_alias = ContextVar('read_alias', default=None)
+
+
+def get_replica_settings():
+    return {
+        'ALIASES': (),
+        'STICKY_SECONDS': 5,
+        'COOKIE_NAME': 'primary_until',
+        **getattr(settings, 'DATABASE_REPLICAS', {}),
+    }
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        return read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # На репликах те же данные, что и в основной БД.
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db in get_replica_settings()['ALIASES']:
+            return False
+        return None
+
+
+def credentials_key(request):
+    credentials = request.META.get('HTTP_AUTHORIZATION')
+    if not credentials:
+        return None
+    return hashlib.sha256(credentials.encode()).hexdigest()
+
+
+class ReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = get_replica_settings()
+        if not config['ALIASES']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.aliases = list(config['ALIASES'])
+        self.sticky_seconds = config['STICKY_SECONDS']
+        self.cookie_name = config['COOKIE_NAME']
+        self.pins = get_cache('REPLICA_PINS')
+        if asyncio.iscoroutinefunction(get_response):
+            # Как в django.utils.deprecation.MiddlewareMixin.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        token = read_alias.set(self.choose_alias(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            read_alias.reset(token)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        token = read_alias.set(self.choose_alias(request))
+        try:
+            response = await self.get_response(request)
+        finally:
+            read_alias.reset(token)
+        return self.pin(request, response)
+
+    def choose_alias(self, request):
+        if request.method not in SAFE_METHODS or self.is_pinned(request):
+            return None
+        return random.choice(self.aliases)
+
+    def is_pinned(self, request):
+        try:
+            until = float(request.COOKIES.get(self.cookie_name, 0))
+        except ValueError:
+            until = 0
+        if until > time.time():
+            return True
+        key = credentials_key(request)
+        return key is not None and (self.pins.get(key) or 0) > time.time()
+
+    def pin(self, request, response):
+        """После запроса с записью клиент читает из основной БД."""
+        if request.method in SAFE_METHODS:
+            return response
+        until = time.time() + self.sticky_seconds
+        response.set_cookie(
+            self.cookie_name, str(until), max_age=self.sticky_seconds,
+            httponly=True, samesite='Lax')
+        key = credentials_key(request)
+        if key is not None:
+            self.pins.set(key, until)
+        return response
@@ -0,0 +1,137 @@
+"""Сборка ответов с рецептами из общего кэша и флагов пользователя.
+
+Публичная часть рецепта — то, что видит анонимный пользователь, — не
+зависит от того, кто спрашивает, поэтому сериализуется один раз на
+версию рецепта и хранится в кэше RECIPE_CACHE. Ключ включает updated_at
+рецепта и его автора, так что любое изменение просто даёт новый ключ.
+Поля, которые меняются без изменения updated_at, накладываются поверх
+(live_fields): счётчики из той же выборки with_versions() и флаги
+is_favorited, is_in_shopping_cart и is_subscribed из множеств
+api.memberships.
+"""
+from django.contrib.auth.models import AnonymousUser
+from django.http import Http404
+from rest_framework.response import Response
+
+from .cache import get_cache
+from .memberships import get_memberships
+from .serializers import RecipeReadSerializer
+from recipes.models import Recipes
+
+# Меняется вместе с форматом RecipeReadSerializer, чтобы не читать
+# из общего кэша представления старого вида.
+REPRESENTATION_VERSION = 1
+
+
+def get_recipe_cache():
+    return get_cache('RECIPE_CACHE')
+
+
+def cache_key(recipe, request):
+    """Ключ версии рецепта; адрес сайта входит в него из-за ссылок
+    на изображения."""
+    return (
+        f'recipe:{REPRESENTATION_VERSION}:{recipe.pk}:'
+        f'{recipe.updated_at.timestamp()}:'
+        f'{recipe.author_updated_at.timestamp()}:'
+        f'{request.build_absolute_uri("/")}'
+    )
+
+
+def public_representations(recipes, request):
+    """Публичные представления рецептов по id, недостающие — из БД."""
+    cache = get_recipe_cache()
+    keys = {recipe.pk: cache_key(recipe, request) for recipe in recipes}
+    found = cache.get_many(keys.values())
+    missing = [pk for pk, key in keys.items() if key not in found]
+    if missing:
+        fresh = {
+            keys[data['id']]: data
+            for data in RecipeReadSerializer(
+                Recipes.objects.for_read(AnonymousUser()).filter(
+                    pk__in=missing),
+                many=True,
+                context={'request': request},
+            ).data
+        }
+        cache.set_many(fresh)
+        found.update(fresh)
+    return {pk: found[key] for pk, key in keys.items() if key in found}
+
+
+def live_fields(recipe, memberships):
+    """Поля рецепта и его автора, не входящие в общий кэш."""
+    return {
+        'favorites_count': recipe.favorites_count,
+        'in_carts_count': recipe.in_carts_count,
+        'is_favorited': recipe.pk in memberships.favorites,
+        'is_in_shopping_cart': recipe.pk in memberships.shop_cart,
+    }, {
+        'followers_count': recipe.author_followers_count,
+        'recipes_count': recipe.author_recipes_count,
+        'is_subscribed': recipe.author_id in memberships.follows,
+    }
+
+
+def represent_recipes(recipes, request):
+    """Представления рецептов как у RecipeReadSerializer для
+    request.user. Рецепты должны быть получены через with_versions()."""
+    public = public_representations(recipes, request)
+    memberships = get_memberships(request.user)
+    result = []
+    for recipe in recipes:
+        if recipe.pk not in public:
+            continue
+        fields, author_fields = live_fields(recipe, memberships)
+        data = dict(public[recipe.pk], **fields)
+        data['author'] = dict(data['author'], **author_fields)
+        data.update(RecipeReadSerializer.optional_data(recipe))
+        result.append(data)
+    return result
+
+
+class SharedRepresentationMixin:
+    """list/retrieve рецептов через represent_recipes().
+
+    Вьюсет для безопасных методов возвращает из get_queryset() набор
+    Recipes.objects.with_versions().
+    """
+
+    def representation_state(self, request, recipes):
+        """Всё, от чего зависит представление рецептов, кроме запроса."""
+        memberships = get_memberships(request.user)
+        return [
+            (recipe.pk, recipe.updated_at, recipe.author_updated_at,
+             live_fields(recipe, memberships))
+            for recipe in recipes
+        ]
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        return self.list_response(
+            request, list(queryset) if page is None else page,
+            paginated=page is not None)
+
+    def annotate_page(self, request, recipes):
+        """Аннотации, которые фильтры считают только для выдачи."""
+        for backend in self.filter_backends:
+            if hasattr(backend, 'annotate_page'):
+                backend().annotate_page(request, recipes, self)
+
+    def list_response(self, request, recipes, paginated):
+        self.annotate_page(request, recipes)
+        data = represent_recipes(recipes, request)
+        if not paginated:
+            return Response(data)
+        return self.get_paginated_response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.retrieve_response(request, self.get_object())
+
+    def retrieve_response(self, request, recipe):
+        self.annotate_page(request, [recipe])
+        data = represent_recipes([recipe], request)
+        if not data:
+            raise Http404
+        return Response(data[0])
@@ -1,19 +1,41 @@
-from http import HTTPStatus
-
-from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
 from django.db import transaction
 from djoser.serializers import UserCreateSerializer as DjoserUCreateSerializer
 from djoser.serializers import UserSerializer as DjoserUserSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
-from rest_framework.fields import IntegerField, SerializerMethodField
+from rest_framework.fields import IntegerField
 from rest_framework.relations import PrimaryKeyRelatedField
 
+from .memberships import get_memberships
 from recipes import constants
-from recipes.models import Ingredient, IngredientInRecipe, Recipes, Tags
+from recipes.fulltext import render_headline, update_search_index
+from recipes.images import delete_variant_files, schedule_image_variants
+from recipes.models import (Ingredient, IngredientInRecipe, Recipes,
+                            ShoppingListItem, Tags)
+from recipes.shopping_list import add_recipes, remove_recipes
 from users.models import Follow, User
 
 
+class ImageSrcsetField(serializers.ReadOnlyField):
+    """Уменьшенные копии изображения рецепта в формате srcset."""
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = 'image_variants'
+        super().__init__(**kwargs)
+
+    def to_representation(self, variants):
+        request = self.context.get('request')
+        urls = []
+        for width, name in sorted(
+                variants.items(), key=lambda item: int(item[0])):
+            url = default_storage.url(name)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            urls.append(f'{url} {width}w')
+        return ', '.join(urls)
+
+
 class UserCreateSerializer(DjoserUCreateSerializer):
 
     class Meta:
@@ -27,12 +49,14 @@ class UsersSerializer(DjoserUserSerializer):
     class Meta:
         model = User
         fields = ('id', 'email', 'username', 'first_name',
-                  'last_name', 'is_subscribed',)
+                  'last_name', 'is_subscribed',
+                  'followers_count', 'recipes_count',)
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        return (user.is_authenticated
-                and user.follower.filter(author=obj).exists())
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return obj.pk in get_memberships(
+            self.context.get('request').user).follows
 
 
 class SubscribeSerializer(serializers.ModelSerializer):
@@ -45,21 +69,6 @@ class SubscribeSerializer(serializers.ModelSerializer):
             'user',
         )
 
-    def validate(self, data):
-        user = data.get('user')
-        author = data.get('author')
-
-        if user.follower.filter(author=author).exists():
-            raise ValidationError(
-                'Вы уже подписаны на этого автора'
-            )
-        if user == author:
-            raise ValidationError(
-                'Подписаться на самого себя невозможно',
-                code=HTTPStatus.BAD_REQUEST,
-            )
-        return data
-
 
 class TagSerializer(serializers.ModelSerializer):
 
@@ -86,30 +95,46 @@ class IngredientInRecipeReadSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount',)
 
 
+class ShoppingListItemSerializer(IngredientInRecipeReadSerializer):
+
+    class Meta(IngredientInRecipeReadSerializer.Meta):
+        model = ShoppingListItem
+
+
 class RecipeReadSerializer(serializers.ModelSerializer):
     tags = TagSerializer(many=True)
     ingredients = IngredientInRecipeReadSerializer(
         many=True, source='ingredient_list')
     author = UsersSerializer()
     image = Base64ImageField()
-    is_favorited = SerializerMethodField(read_only=True)
-    is_in_shopping_cart = SerializerMethodField(read_only=True)
+    image_srcset = ImageSrcsetField()
+    is_favorited = serializers.BooleanField(read_only=True)
+    is_in_shopping_cart = serializers.BooleanField(read_only=True)
 
     class Meta:
         model = Recipes
         fields = ('id', 'tags', 'author',
                   'ingredients', 'is_favorited',
-                  'is_in_shopping_cart', 'image',
-                  'name', 'text', 'cooking_time',)
-
-    def get_is_favorited(self, obj):
-        user = self.context.get('request').user
-        return not user.is_anonymous and user.favorite.filter(
-            recipe=obj).exists()
+                  'is_in_shopping_cart', 'image', 'image_srcset',
+                  'name', 'text', 'cooking_time',
+                  'favorites_count', 'in_carts_count',)
+
+    # Аннотации, которые добавляют поиск и подбор по ингредиентам.
+    optional_fields = ('search_rank', 'search_headline',
+                       'matched_ingredients', 'missing_ingredients')
+
+    @classmethod
+    def optional_data(cls, instance):
+        data = {field: getattr(instance, field)
+                for field in cls.optional_fields if hasattr(instance, field)}
+        if 'search_headline' in data:
+            data['search_headline'] = render_headline(data['search_headline'])
+        return data
 
-    def get_is_in_shopping_cart(self, obj):
-        user = self.context.get('request').user
-        return not user.is_anonymous and user.shop.filter(recipe=obj).exists()
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data.update(self.optional_data(instance))
+        return data
 
 
 class IngredientInRecipeCreateSerializer(serializers.ModelSerializer):
@@ -158,14 +183,54 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         if not tags:
             raise serializers.ValidationError(
                 {'tags': 'Нужно выбрать хотя бы один тег!'})
+        if 'ingredients' in data:
+            self.validate_ingredients_exist(data['ingredients'])
         return data
 
+    def validate_ingredients_exist(self, ingredients):
+        ids = {ingredient['id'] for ingredient in ingredients}
+        missing = ids - set(Ingredient.objects.filter(
+            id__in=ids).values_list('id', flat=True))
+        if missing:
+            raise serializers.ValidationError(
+                {'ingredients': 'Ингредиенты не найдены: '
+                 f'{", ".join(map(str, sorted(missing)))}.'}
+            )
+
     def create_ingredients(self, ingredients, recipe):
-        for ingredient in ingredients:
-            IngredientInRecipe.objects.create(
+        IngredientInRecipe.objects.bulk_create(
+            IngredientInRecipe(
                 recipe=recipe,
                 ingredient_id=ingredient.get('id'),
                 amount=ingredient.get('amount'), )
+            for ingredient in ingredients
+        )
+
+    def update_ingredients(self, ingredients, recipe):
+        """Меняет только добавленные, удалённые и изменённые строки."""
+        amounts = {
+            ingredient['id']: ingredient['amount']
+            for ingredient in ingredients
+        }
+        current = {
+            row.ingredient_id: row for row in recipe.ingredient_list.all()
+        }
+        removed = current.keys() - amounts.keys()
+        if removed:
+            recipe.ingredient_list.filter(ingredient_id__in=removed).delete()
+        changed = []
+        for ingredient_id, row in current.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and row.amount != amount:
+                row.amount = amount
+                changed.append(row)
+        if changed:
+            IngredientInRecipe.objects.bulk_update(changed, ('amount',))
+        self.create_ingredients(
+            [ingredient for ingredient in ingredients
+             if ingredient['id'] not in current],
+            recipe
+        )
 
     @transaction.atomic
     def create(self, validated_data):
@@ -174,48 +239,80 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         recipe = Recipes.objects.create(**validated_data)
         recipe.tags.set(tags)
         self.create_ingredients(ingredients, recipe)
+        update_search_index([recipe.pk])
+        schedule_image_variants(recipe)
         return recipe
 
     @transaction.atomic
     def update(self, instance, validated_data):
         if 'ingredients' in validated_data:
-            ingredients = validated_data.pop('ingredients')
-            instance.ingredients.clear()
-            self.create_ingredients(ingredients, instance)
+            # Списки покупок пересчитываются: старый состав вычитается,
+            # новый прибавляется.
+            remove_recipes([instance.pk])
+            self.update_ingredients(
+                validated_data.pop('ingredients'), instance)
+            add_recipes([instance.pk])
         if 'tags' in validated_data:
             instance.tags.set(
                 validated_data.pop('tags'))
-        return super().update(
-            instance, validated_data)
+        if 'image' in validated_data:
+            stale = list(instance.image_variants.values())
+            validated_data['image_variants'] = {}
+            transaction.on_commit(lambda: delete_variant_files(stale))
+        instance = super().update(instance, validated_data)
+        update_search_index([instance.pk])
+        if 'image' in validated_data:
+            schedule_image_variants(instance)
+        return instance
 
     def to_representation(self, instance):
+        request = self.context.get('request')
+        instance = Recipes.objects.for_read(request.user).get(pk=instance.pk)
         return RecipeReadSerializer(instance, context={
-            'request': self.context.get('request')
+            'request': request
         }).data
 
 
 class RecipeShortSerializer(serializers.ModelSerializer):
     image = Base64ImageField()
+    image_srcset = ImageSrcsetField()
 
     class Meta:
         model = Recipes
-        fields = ('id', 'name', 'image', 'cooking_time',)
+        fields = ('id', 'name', 'image', 'image_srcset', 'cooking_time',)
 
 
 class FollowSerializer(UsersSerializer):
-    recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    """Автор из подписок, ожидает подгруженный latest_recipes."""
+
+    recipes = RecipeShortSerializer(
+        many=True, read_only=True, source='latest_recipes')
 
     class Meta(UsersSerializer.Meta):
-        fields = UsersSerializer.Meta.fields + ('recipes', 'recipes_count')
+        fields = UsersSerializer.Meta.fields + ('recipes',)
         read_only_fields = UsersSerializer.Meta.fields
 
-    def get_recipes(self, obj):
-        limit = self.context.get("request").GET.get("recipes_limit")
-        queryset = obj.recipe.all()
-        if limit:
-            queryset = queryset[:int(limit)]
-        return RecipeShortSerializer(queryset, many=True).data
 
-    def get_recipes_count(self, obj):
-        return obj.recipe.count()
+class SubscriptionsParamsSerializer(serializers.Serializer):
+    recipes_limit = serializers.IntegerField(
+        min_value=0, max_value=constants.RECIPES_LIMIT_MAX, required=False)
+
+
+class BulkToggleSerializer(serializers.Serializer):
+    """id рецептов для пакетного добавления и удаления."""
+
+    add = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        max_length=constants.BULK_TOGGLE_MAX, default=list)
+    remove = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        max_length=constants.BULK_TOGGLE_MAX, default=list)
+
+    def validate(self, data):
+        if not data['add'] and not data['remove']:
+            raise serializers.ValidationError(
+                'Передайте id рецептов в add или remove.')
+        if set(data['add']) & set(data['remove']):
+            raise serializers.ValidationError(
+                'Рецепт не может быть одновременно в add и remove.')
+        return data
@@ -0,0 +1,50 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api.authentication import forget_token, forget_user
+from api.cache import bump_reference_version
+from api.memberships import track_membership
+from recipes.models import Favorite, Ingredient, ShopCart, Tags
+from recipes.signals import ingredients_imported
+from users.models import Follow, User
+
+
+@receiver((post_save, post_delete), sender=Tags)
+def invalidate_tags_cache(**kwargs):
+    bump_reference_version('tags')
+
+
+@receiver((post_save, post_delete, ingredients_imported), sender=Ingredient)
+def invalidate_ingredients_cache(**kwargs):
+    bump_reference_version('ingredients')
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShopCart)
+@receiver(post_save, sender=Follow)
+def add_membership(instance, created, **kwargs):
+    if created:
+        track_membership(instance)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShopCart)
+@receiver(post_delete, sender=Follow)
+def remove_membership(instance, **kwargs):
+    track_membership(instance)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token(instance, **kwargs):
+    # После удаления Collector обнуляет первичный ключ объекта,
+    # поэтому ключ запоминается до коммита.
+    transaction.on_commit(partial(forget_token, instance.key))
+
+
+@receiver((post_save, post_delete), sender=User)
+def invalidate_user(instance, **kwargs):
+    transaction.on_commit(partial(forget_user, instance.pk))
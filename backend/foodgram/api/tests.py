@@ -0,0 +1,347 @@
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.core.handlers.asgi import ASGIHandler
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.authentication import get_auth_cache, token_key, user_key
+from api.cache import _caches
+from api.metrics import registry
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipes,
+                            ShopCart, ShoppingListItem, Tags)
+from users.models import Follow, User
+
+
+class QueryCountTests(TestCase):
+    """Число запросов к БД не зависит от размера страницы, ETag
+    меняется вместе с данными."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                email=f'user{number}@example.com', username=f'user{number}',
+                first_name='Имя', last_name='Фамилия', password='password')
+            for number in range(4)
+        ]
+        tags = [
+            Tags.objects.create(
+                name=f'Тег {number}', color=f'#00000{number}',
+                slug=f'tag{number}')
+            for number in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(10)
+        ]
+        for number in range(12):
+            recipe = Recipes.objects.create(
+                author=cls.users[number % 4], name=f'Рецепт {number}',
+                text='Описание', cooking_time=10, image='recipes/x.png')
+            recipe.tags.set(tags[:number % 3 + 1])
+            IngredientInRecipe.objects.bulk_create(
+                IngredientInRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=number + 1)
+                for ingredient in ingredients[:number % 5 + 1]
+            )
+            if number % 2:
+                Favorite.objects.create(author=cls.users[0], recipe=recipe)
+            if number % 3:
+                ShopCart.objects.create(author=cls.users[0], recipe=recipe)
+        for author in cls.users[1:]:
+            Follow.objects.create(user=cls.users[0], author=author)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def count_queries(self, url):
+        # Кэши представлений и принадлежности живут в памяти процесса:
+        # каждый замер начинается с холодных кэшей.
+        _caches.clear()
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(captured), response
+
+    def assertConstantQueries(self, urls, expected):
+        for url in urls:
+            with self.subTest(url=url):
+                queries, _ = self.count_queries(url)
+                self.assertEqual(queries, expected)
+
+    def test_recipe_list(self):
+        self.assertConstantQueries(
+            ('/api/recipes/?limit=2', '/api/recipes/?limit=12'), 7)
+
+    def test_recipe_list_anonymous(self):
+        self.client.force_authenticate(None)
+        self.assertConstantQueries(
+            ('/api/recipes/?limit=2', '/api/recipes/?limit=12'), 6)
+
+    def test_recipe_detail(self):
+        recipe = Recipes.objects.order_by('pk').last()
+        self.assertConstantQueries((f'/api/recipes/{recipe.pk}/',), 6)
+
+    def test_subscriptions(self):
+        self.assertConstantQueries((
+            '/api/users/subscriptions/?limit=1&recipes_limit=1',
+            '/api/users/subscriptions/?limit=3&recipes_limit=3',
+            '/api/users/subscriptions/?limit=3',
+        ), 3)
+
+    def test_flags(self):
+        recipe = Recipes.objects.filter(favorite__author=self.users[0]).first()
+        _, response = self.count_queries(f'/api/recipes/{recipe.pk}/')
+        self.assertTrue(response.data['is_favorited'])
+        self.assertTrue(response.data['author']['is_subscribed'])
+
+    def test_not_modified(self):
+        for url in ('/api/recipes/?limit=2', '/api/recipes/?cursor=',
+                    f'/api/recipes/{Recipes.objects.first().pk}/'):
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                Recipes.objects.filter(pk=Recipes.objects.first().pk).update(
+                    name='Новое', updated_at=timezone.now())
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+
+    def test_toggle_keeps_shared_version(self):
+        recipe = Recipes.objects.exclude(
+            favorite__author=self.users[0]).first()
+        url = f'/api/recipes/{recipe.pk}/'
+        before = self.client.get(url)
+        favorite = f'/api/recipes/{recipe.pk}/favorite/'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(favorite).status_code, 201)
+        self.assertEqual(self.client.post(favorite).status_code, 400)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=before['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_favorited'])
+        self.assertEqual(
+            response.data['favorites_count'],
+            before.data['favorites_count'] + 1)
+        self.assertEqual(
+            Recipes.objects.get(pk=recipe.pk).updated_at, recipe.updated_at)
+
+    def test_cursor_requires_id_ordering(self):
+        for query, code in (('ordering=id', 200), ('ordering=-id', 200),
+                            ('ordering=favorites_count', 400),
+                            ('ordering=-in_carts_count', 400),
+                            ('search=Рецепт', 400)):
+            with self.subTest(query=query):
+                response = self.client.get(f'/api/recipes/?cursor=&{query}')
+                self.assertEqual(response.status_code, code)
+
+    @override_settings(METRICS={'ENABLED': True, 'ALLOWED_IPS': ()})
+    def test_metrics_under_asgi(self):
+        # Под ASGI синхронное представление выполняется в потоке
+        # sync_to_async: его запросы к БД тоже попадают в замер.
+        _caches.clear()
+        handler = ASGIHandler()
+        scope = {
+            'type': 'http', 'method': 'GET', 'query_string': b'',
+            'path': f'/api/recipes/{Recipes.objects.last().pk}/',
+            'headers': [],
+        }
+
+        async def request():
+            communicator = ApplicationCommunicator(handler, scope)
+            await communicator.send_input({'type': 'http.request'})
+            start = await communicator.receive_output()
+            await communicator.receive_output()
+            return start['status']
+
+        labels = ('recipes-detail', 'GET')
+        before = registry.queries._series.get(labels, [None, 0])[1]
+        # Как тестовый клиент: соединение с транзакцией теста не закрывать.
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        try:
+            with CaptureQueriesContext(connection) as captured:
+                status = async_to_sync(request)()
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+        self.assertEqual(status, 200)
+        self.assertEqual(
+            registry.queries._series[labels][1] - before, len(captured))
+
+
+class ToggleTests(TestCase):
+    """Избранное, корзина и подписки со счётчиками. На PostgreSQL это
+    ветка с CTE в recipes.toggles, на остальных базах — ORM."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.author = (
+            User.objects.create_user(
+                email=f'{name}@example.com', username=name,
+                first_name='Имя', last_name='Фамилия', password='password')
+            for name in ('user', 'author')
+        )
+        cls.ingredient = Ingredient.objects.create(
+            name='Соль', measurement_unit='г')
+        cls.recipes = []
+        for number in range(3):
+            recipe = Recipes.objects.create(
+                author=cls.author, name=f'Рецепт {number}', text='Описание',
+                cooking_time=10, image='recipes/x.png')
+            IngredientInRecipe.objects.create(
+                recipe=recipe, ingredient=cls.ingredient, amount=number + 1)
+            cls.recipes.append(recipe)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def counter(self, instance, field):
+        return type(instance).objects.values_list(
+            field, flat=True).get(pk=instance.pk)
+
+    def shopping_list(self):
+        return dict(ShoppingListItem.objects.filter(
+            user=self.user).values_list('ingredient_id', 'amount'))
+
+    def assertToggle(self, url, counted, field, created_status=201):
+        for method, expected, count in (
+                ('post', created_status, 1), ('post', 400, 1),
+                ('delete', 204, 0), ('delete', 400, 0)):
+            with self.subTest(url=url, method=method, expected=expected):
+                response = getattr(self.client, method)(url)
+                self.assertEqual(response.status_code, expected)
+                self.assertEqual(self.counter(counted, field), count)
+
+    def test_favorite(self):
+        recipe = self.recipes[0]
+        self.assertToggle(
+            f'/api/recipes/{recipe.pk}/favorite/', recipe, 'favorites_count')
+
+    def test_shopping_cart(self):
+        recipe = self.recipes[1]
+        url = f'/api/recipes/{recipe.pk}/shopping_cart/'
+        self.client.post(url)
+        self.assertEqual(self.shopping_list(), {self.ingredient.pk: 2})
+        self.client.delete(url)
+        self.assertEqual(self.shopping_list(), {})
+        self.assertToggle(url, recipe, 'in_carts_count')
+
+    def test_subscribe(self):
+        self.assertToggle(
+            f'/api/users/{self.author.pk}/subscribe/', self.author,
+            'followers_count')
+
+    def test_missing_object(self):
+        for url in ('/api/recipes/0/favorite/',
+                    '/api/recipes/0/shopping_cart/',
+                    '/api/users/0/subscribe/'):
+            for method in ('post', 'delete'):
+                with self.subTest(url=url, method=method):
+                    response = getattr(self.client, method)(url)
+                    self.assertEqual(response.status_code, 404)
+
+    def test_remove_never_counted_link(self):
+        # Связь, созданная до появления счётчиков: счётчик остаётся 0.
+        recipe = self.recipes[2]
+        Favorite.objects.bulk_create(
+            [Favorite(author=self.user, recipe=recipe)])
+        response = self.client.delete(f'/api/recipes/{recipe.pk}/favorite/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.counter(recipe, 'favorites_count'), 0)
+
+    def bulk(self, url, method='post', **data):
+        response = getattr(self.client, method)(url, data, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return {item['id']: item['status']
+                for item in response.data['results']}
+
+    def assertBulkToggle(self, url, field, shopping_list=None):
+        first, second, third = (recipe.pk for recipe in self.recipes)
+        missing = third + 100
+        counts = {}
+
+        def check(step):
+            for recipe in self.recipes:
+                self.assertEqual(
+                    self.counter(recipe, field), counts.get(recipe.pk, 0),
+                    (step, recipe.pk))
+            if shopping_list is not None:
+                self.assertEqual(self.shopping_list(), shopping_list[step])
+
+        self.assertEqual(
+            self.bulk(url, add=[first, second, missing]),
+            {first: 'added', second: 'added', missing: 'not_found'})
+        counts = {first: 1, second: 1}
+        check('added')
+        self.assertEqual(
+            self.bulk(url, add=[second, third], remove=[first]),
+            {first: 'removed', second: 'exists', third: 'added'})
+        counts = {second: 1, third: 1}
+        check('mixed')
+        self.assertEqual(
+            self.bulk(url, remove=[first, missing]),
+            {first: 'absent', missing: 'not_found'})
+        check('mixed')
+        self.assertEqual(
+            self.bulk(url, 'delete'),
+            {second: 'removed', third: 'removed'})
+        counts = {}
+        check('cleared')
+        response = self.client.post(url, {}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_favorite(self):
+        self.assertBulkToggle('/api/recipes/favorite/', 'favorites_count')
+
+    def test_bulk_shopping_cart(self):
+        self.assertBulkToggle(
+            '/api/recipes/shopping_cart/', 'in_carts_count', shopping_list={
+                'added': {self.ingredient.pk: 1 + 2},
+                'mixed': {self.ingredient.pk: 2 + 3},
+                'cleared': {},
+            })
+
+
+class AuthCacheTests(TestCase):
+    """Записи кэша аутентификации удаляются после коммита удаления."""
+
+    def setUp(self):
+        _caches.clear()
+        self.user = User.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Имя', last_name='Фамилия', password='password')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def assertCached(self, key, cached=True):
+        self.assertEqual(get_auth_cache().get(key) is not None, cached)
+
+    def test_delete_token(self):
+        key = self.token.key
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        self.assertCached(token_key(key))
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.token.delete()
+        self.assertCached(token_key(key), cached=False)
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_delete_user(self):
+        key, user_id = self.token.key, self.user.pk
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        self.assertCached(user_key(user_id))
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.user.delete()
+        self.assertCached(token_key(key), cached=False)
+        self.assertCached(user_key(user_id), cached=False)
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
@@ -1,6 +1,8 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from .metrics import metrics_view
 from .views import (CustomUserViewSet, IngredientViewSet, RecipeViewSet,
                     TagViewSet)
 
@@ -12,7 +14,11 @@ router.register('users', CustomUserViewSet)
 
 
 urlpatterns = [
+    path('_metrics', metrics_view, name='metrics'),
     path('', include(router.urls)),
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
 ]
+
+if settings.AUTH_JWT_ENABLED:
+    urlpatterns.append(path('auth/', include('djoser.urls.jwt')))
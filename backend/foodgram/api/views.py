@@ -1,27 +1,44 @@
-from django.db.models import Sum
-from django.http import HttpResponse
-from django.shortcuts import get_object_or_404
+from contextlib import nullcontext
+from itertools import chain
+
+from django.db import transaction
+from django.db.models import (BooleanField, Prefetch, Value,
+                              prefetch_related_objects)
+from django.http import Http404, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.filters import OrderingFilter
 from rest_framework.permissions import SAFE_METHODS, IsAuthenticated
 from rest_framework.response import Response
 
-from .filters import IngredientFilter, RecipeFilter
-from .mixins import ListRetrieve
+from .async_views import AsyncViewSetMixin
+from .cache import ConditionalGetMixin, ReferenceCacheMixin
+from .filters import IngredientFilter, RecipeFilter, RecipeSearchFilter
+from .memberships import invalidate_memberships
+from .mixins import CursorPaginationMixin, ListRetrieve
 from .pagination import LimitPagination
 from .permissions import IsAdminOrReadOnly, IsAuthorOrReadOnly
-from .serializers import (FollowSerializer, IngredientSerializer,
-                          RecipeCreateSerializer, RecipeReadSerializer,
-                          RecipeShortSerializer, SubscribeSerializer,
-                          TagSerializer, UsersSerializer)
-from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipes,
-                            ShopCart, Tags)
+from .renderers import (ShoppingListCSVRenderer, ShoppingListJSONRenderer,
+                        ShoppingListTextRenderer)
+from .representation import SharedRepresentationMixin
+from .serializers import (BulkToggleSerializer, FollowSerializer,
+                          IngredientSerializer, RecipeCreateSerializer,
+                          RecipeReadSerializer, RecipeShortSerializer,
+                          ShoppingListItemSerializer, SubscribeSerializer,
+                          SubscriptionsParamsSerializer, TagSerializer,
+                          UsersSerializer)
+from recipes.models import (Favorite, Ingredient, Recipes, ShopCart,
+                            ShoppingListItem, Tags)
+from recipes.shopping_list import add_recipes, remove_recipes
+from recipes.toggles import (add_link, add_links, remove_link,
+                             remove_links)
 from users.models import Follow, User
 
 
-class IngredientViewSet(ListRetrieve):
+class IngredientViewSet(ReferenceCacheMixin, AsyncViewSetMixin, ListRetrieve):
+    cache_namespace = 'ingredients'
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (IsAdminOrReadOnly,)
@@ -30,19 +47,34 @@ class IngredientViewSet(ListRetrieve):
     search_fields = ['^name', ]
 
 
-class TagViewSet(ListRetrieve):
+class TagViewSet(ReferenceCacheMixin, AsyncViewSetMixin, ListRetrieve):
+    cache_namespace = 'tags'
     queryset = Tags.objects.all()
     serializer_class = TagSerializer
     permission_classes = (IsAdminOrReadOnly,)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(ConditionalGetMixin, SharedRepresentationMixin,
+                    CursorPaginationMixin, AsyncViewSetMixin,
+                    viewsets.ModelViewSet):
+    lookup_value_regex = r'\d+'
     queryset = Recipes.objects.all()
     serializer_class = RecipeReadSerializer
     permission_classes = (IsAuthorOrReadOnly | IsAdminOrReadOnly,)
-    filter_backends = (DjangoFilterBackend,)
+    filter_backends = (DjangoFilterBackend, OrderingFilter,
+                       RecipeSearchFilter)
     filterset_class = RecipeFilter
+    ordering_fields = ('id', 'favorites_count', 'in_carts_count')
+    ordering = ('-id',)
     pagination_class = LimitPagination
+    # Поля рецепта, которые add_obj читает для RecipeShortSerializer.
+    short_recipe_fields = ('id', 'name', 'image', 'image_variants',
+                           'cooking_time')
+
+    def get_queryset(self):
+        if self.request.method in SAFE_METHODS:
+            return Recipes.objects.with_versions()
+        return Recipes.objects.all()
 
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
@@ -52,20 +84,43 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    def link_transaction(self, model):
+        """Корзина меняется в одной транзакции со списком покупок,
+        избранному хватает одного запроса без транзакции."""
+        if model is ShopCart:
+            return transaction.atomic()
+        return nullcontext()
+
+    def links_changed(self, model, user, added=(), removed=()):
+        if added or removed:
+            invalidate_memberships(model, user.pk)
+        if model is ShopCart:
+            add_recipes(added, user.pk)
+            remove_recipes(removed, user.pk)
+
     def add_obj(self, model, user, pk):
-        if model.objects.filter(author=user, recipe__id=pk).exists():
+        with self.link_transaction(model):
+            recipe, created = add_link(
+                model, user.pk, pk, fields=self.short_recipe_fields)
+            if created:
+                self.links_changed(model, user, added=(recipe.pk,))
+        if recipe is None:
+            raise Http404
+        if not created:
             return Response({'errors': 'Рецепт уже добавлен!'},
                             status=status.HTTP_400_BAD_REQUEST)
-        recipe = get_object_or_404(Recipes, id=pk)
-        model.objects.create(author=user, recipe=recipe)
         serializer = RecipeShortSerializer(recipe)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     def delete_obj(self, model, user, pk):
-        obj = model.objects.filter(author=user, recipe__pk=pk)
-        if obj.exists():
-            obj.delete()
+        with self.link_transaction(model):
+            exists, deleted = remove_link(model, user.pk, pk)
+            if deleted:
+                self.links_changed(model, user, removed=(int(pk),))
+        if deleted:
             return Response(status=status.HTTP_204_NO_CONTENT)
+        if not exists:
+            raise Http404
         return Response({'errors': 'Рецепт уже удален!'},
                         status=status.HTTP_400_BAD_REQUEST)
 
@@ -89,38 +144,125 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return self.add_obj(ShopCart, request.user, pk)
         return self.delete_obj(ShopCart, request.user, pk)
 
+    @transaction.atomic
+    def bulk_toggle(self, model, request):
+        """Пакетное изменение избранного или корзины.
+
+        POST {"add": [...], "remove": [...]} добавляет и удаляет рецепты,
+        DELETE удаляет все. Для каждого id возвращается результат:
+        added, exists, removed, absent или not_found.
+        """
+        user = request.user
+        if request.method == 'DELETE':
+            _, removed = remove_links(model, user.pk)
+            self.links_changed(model, user, removed=removed)
+            return Response({'results': [
+                {'id': pk, 'status': 'removed'} for pk in sorted(removed)
+            ]})
+        serializer = BulkToggleSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        to_add = list(dict.fromkeys(serializer.validated_data['add']))
+        to_remove = list(dict.fromkeys(serializer.validated_data['remove']))
+        results = []
+        if to_remove:
+            found, removed = remove_links(model, user.pk, to_remove)
+            results += [
+                {'id': pk, 'status': 'removed' if pk in removed
+                 else 'absent' if pk in found else 'not_found'}
+                for pk in to_remove
+            ]
+            self.links_changed(model, user, removed=removed)
+        if to_add:
+            found, created = add_links(model, user.pk, to_add)
+            results += [
+                {'id': pk, 'status': 'added' if pk in created
+                 else 'exists' if pk in found else 'not_found'}
+                for pk in to_add
+            ]
+            self.links_changed(model, user, added=created)
+        return Response({'results': results})
+
     @action(
         detail=False,
-        methods=['get'],
+        methods=['post', 'delete'],
+        url_path='favorite',
+        url_name='favorite-bulk',
         permission_classes=[IsAuthenticated]
     )
+    def favorite_bulk(self, request):
+        return self.bulk_toggle(Favorite, request)
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='shopping_cart',
+        url_name='shopping-cart-bulk',
+        permission_classes=[IsAuthenticated]
+    )
+    def shopping_cart_bulk(self, request):
+        return self.bulk_toggle(ShopCart, request)
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=[IsAuthenticated],
+    )
+    def shopping_list(self, request):
+        """Список покупок постранично, по строке на ингредиент."""
+        items = ShoppingListItem.objects.filter(
+            user=request.user
+        ).select_related('ingredient').order_by('ingredient__name')
+        page = self.paginate_queryset(items)
+        serializer = ShoppingListItemSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=[IsAuthenticated],
+        renderer_classes=(ShoppingListTextRenderer, ShoppingListCSVRenderer,
+                          ShoppingListJSONRenderer),
+    )
     def download_shopping_cart(self, request):
-        string = f'Список покупок для : {request.user.username}\n'
-        ingredients = IngredientInRecipe.objects.filter(
-            recipe__shop__author=request.user
+        """Потоковая выгрузка списка покупок в формате ?format=txt|csv|json.
+
+        Суммы ингредиентов уже посчитаны в ShoppingListItem и читаются
+        через iterator(), поэтому память и число запросов не зависят
+        от размера корзины.
+        """
+        renderer = request.accepted_renderer
+        ingredients = ShoppingListItem.objects.filter(
+            user=request.user
         ).values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(amount=Sum('amount'))
-        for num, ingred in enumerate(ingredients):
-            string += (
-                f'\n* {ingred["ingredient__name"]} — {ingred["amount"]} '
-                f'{ingred["ingredient__measurement_unit"]}'
-            )
-            if num < ingredients.count() - 1:
-                string += '; '
-        filename = f'{request.user.username}_string.txt'
-        response = HttpResponse(
-            f'{string} \n\nУдачные покупки только с Foodgram:)',
-            content_type='text/plain')
-        response['Content-Disposition'] = f'attachment; filename="{filename}'
+            'ingredient__name', 'ingredient__measurement_unit', 'amount'
+        ).order_by('ingredient__name')
+        # Тело ответа читается уже после выхода из middleware: база для
+        # чтения (api.replicas) фиксируется здесь, а запрос выполняется
+        # первым next(), чтобы попасть в метрики запроса.
+        rows = ingredients.using(ingredients.db).iterator()
+        first = next(rows, None)
+        if first is not None:
+            rows = chain((first,), rows)
+        filename = f'{request.user.username}_shopping_list.{renderer.format}'
+        response = StreamingHttpResponse(
+            renderer.stream(rows, request.user),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
         return response
 
 
-class CustomUserViewSet(UserViewSet):
+class CustomUserViewSet(CursorPaginationMixin, UserViewSet):
     queryset = User.objects.all()
     serializer_class = UsersSerializer
+    lookup_value_regex = r'\d+'
     pagination_class = LimitPagination
 
+    def get_instance(self):
+        # request.user мог прийти из кэша аутентификации, а счётчики
+        # пользователя меняются запросами UPDATE мимо него.
+        return User.objects.get(pk=self.request.user.pk)
+
     @action(
         methods=("post",),
         detail=True,
@@ -128,29 +270,44 @@ class CustomUserViewSet(UserViewSet):
     )
     def subscribe(self, request, id):
         """Метод для создания подписки."""
-        data = {"user": request.user.id, "author": id}
+        if int(id) == request.user.pk:
+            return Response(
+                {'errors': 'Подписаться на самого себя невозможно'},
+                status=status.HTTP_400_BAD_REQUEST)
+        author, created = add_link(Follow, request.user.pk, id)
+        if author is None:
+            raise Http404
+        if not created:
+            return Response({'errors': 'Вы уже подписаны на этого автора'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        invalidate_memberships(Follow, request.user.pk)
         serializer = SubscribeSerializer(
-            data=data, context={"request": request}
-        )
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
+            Follow(user=request.user, author_id=author.pk))
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @subscribe.mapping.delete
     def delete_subscribe(self, request, id):
-        subscription = Follow.objects.filter(
-            user=request.user, author_id=id
-        )
-        if subscription.exists():
-            subscription.delete()
+        exists, deleted = remove_link(Follow, request.user.pk, id)
+        if deleted:
+            invalidate_memberships(Follow, request.user.pk)
             return Response(status=status.HTTP_204_NO_CONTENT)
+        if not exists:
+            raise Http404
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
     @action(detail=False, permission_classes=[IsAuthenticated])
     def subscriptions(self, request):
-        user = request.user
-        queryset = User.objects.filter(following__user=user)
+        """Подписки с последними рецептами авторов за три запроса."""
+        params = SubscriptionsParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        queryset = User.objects.filter(following__user=request.user).annotate(
+            is_subscribed=Value(True, output_field=BooleanField())
+        ).order_by('-id')
         pages = self.paginate_queryset(queryset)
+        recipes = Recipes.objects.filter(author__in=pages).latest_per_author(
+            params.validated_data.get('recipes_limit'))
+        prefetch_related_objects(pages, Prefetch(
+            'recipe', queryset=recipes, to_attr='latest_recipes'))
         serializer = FollowSerializer(
             pages,
             many=True,
@@ -3,5 +3,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+os.environ.setdefault('ASYNC_VIEWS_ENABLED', 'True')
 
 application = get_asgi_application()
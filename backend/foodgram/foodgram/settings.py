@@ -1,4 +1,5 @@
 import os
+from datetime import timedelta
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -20,6 +21,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
     'django_filters',
@@ -32,6 +34,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
+    'api.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -62,6 +66,10 @@ TEMPLATES = [
 WSGI_APPLICATION = 'foodgram.wsgi.application'
 
 
+# Соединения живут DB_CONN_MAX_AGE секунд и проверяются перед повторным
+# использованием (CONN_HEALTH_CHECKS из Django 4.1, для 3.2 его выполняет
+# api.connections). За pgbouncer в режиме transaction серверные курсоры
+# QuerySet.iterator() не работают, DB_PGBOUNCER=True их выключает.
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -69,10 +77,39 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER', 'foodgram_user'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
         'HOST': os.getenv('DB_HOST', ''),
-        'DB_PORT': os.getenv('DB_PORT', '5432'),
+        'PORT': os.getenv('DB_PORT', '5432'),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': (
+            os.getenv('DB_CONN_HEALTH_CHECKS', 'True') == 'True'),
+        'DISABLE_SERVER_SIDE_CURSORS': (
+            os.getenv('DB_PGBOUNCER', 'False') == 'True'),
     }
 }
 
+# Реплики для чтения (api/replicas.py): те же настройки, другие хосты.
+for number, host in enumerate(os.getenv('DB_REPLICA_HOSTS', '').split()):
+    DATABASES[f'replica_{number}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+
+DATABASE_REPLICAS = {
+    'ALIASES': [alias for alias in DATABASES if alias != 'default'],
+    'STICKY_SECONDS': int(os.getenv('DB_REPLICA_STICKY_SECONDS', 5)),
+}
+
+# Клиенты без cookie, недавно писавшие в основную БД.
+REPLICA_PINS = {
+    'BACKEND': 'api.cache.LocalLRUCache',
+    'OPTIONS': {
+        'max_entries': 4096,
+        'timeout': DATABASE_REPLICAS['STICKY_SECONDS'],
+    },
+}
+
 AUTH_USER_MODEL = 'users.User'
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -106,18 +143,79 @@ STATIC_ROOT = BASE_DIR / 'collected_static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', 2))
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Подписанные токены simplejwt (auth/jwt/create/) рядом с обычными.
+AUTH_JWT_ENABLED = os.getenv('AUTH_JWT_ENABLED', 'False') == 'True'
+
+SIMPLE_JWT = {
+    'ACCESS_TOKEN_LIFETIME': timedelta(
+        minutes=int(os.getenv('AUTH_JWT_LIFETIME_MINUTES', 5))),
+    'AUTH_HEADER_TYPES': ('Bearer',),
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
+        *(('api.authentication.CachedJWTAuthentication',)
+          if AUTH_JWT_ENABLED else ()),
     ),
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend']
 }
 
+# Отрендеренные теги и ингредиенты. Версию в памяти процесса меняет
+# только воркер, через который прошла запись, остальные увидят изменения
+# через timeout секунд; DjangoCache с общим бэкендом убирает задержку.
+REFERENCE_CACHE = {
+    'BACKEND': 'api.cache.LocalLRUCache',
+    'OPTIONS': {
+        'max_entries': 512,
+        'timeout': int(os.getenv('REFERENCE_CACHE_SECONDS', 60)),
+    },
+}
+
+# Публичные представления рецептов, общие для всех пользователей.
+RECIPE_CACHE = {
+    'BACKEND': 'api.cache.LocalLRUCache',
+    'OPTIONS': {'max_entries': 4096},
+}
+
+# Множества id избранного, корзины и подписок каждого пользователя.
+MEMBERSHIP_CACHE = {
+    'BACKEND': 'api.cache.LocalLRUCache',
+    'OPTIONS': {'max_entries': 4096, 'timeout': 300},
+}
+
+# Пользователи по токенам (api/authentication.py); timeout — сколько
+# другие воркеры принимают токен после выхода или деактивации.
+AUTH_CACHE = {
+    'BACKEND': 'api.cache.LocalLRUCache',
+    'OPTIONS': {
+        'max_entries': 4096,
+        'timeout': int(os.getenv('AUTH_CACHE_SECONDS', 60)),
+    },
+}
+
+# Метрики запросов для Prometheus (/api/_metrics).
+METRICS = {
+    'ENABLED': os.getenv('METRICS_ENABLED', 'False') == 'True',
+    'QUERY_BUDGET': int(os.getenv('METRICS_QUERY_BUDGET', 20)),
+    'ALLOWED_IPS': os.getenv('METRICS_ALLOWED_IPS', '').split(),
+}
+
+# Асинхронные представления под ASGI (api/async_views.py); foodgram/asgi.py
+# включает их по умолчанию. DB_THREADS — размер пула потоков для ORM,
+# он же предел соединений с БД на воркер.
+ASYNC_VIEWS = {
+    'ENABLED': os.getenv('ASYNC_VIEWS_ENABLED', 'False') == 'True',
+    'DB_THREADS': int(os.getenv('ASYNC_DB_THREADS', 8)),
+}
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
     'HIDE_USERS': False,
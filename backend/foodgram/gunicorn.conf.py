@@ -0,0 +1,23 @@
+"""Настройки gunicorn.
+
+SERVER_MODE=sync (по умолчанию) — синхронные воркеры и foodgram.wsgi:
+воркер обслуживает один запрос за раз. SERVER_MODE=async — воркеры
+uvicorn и foodgram.asgi с асинхронными представлениями
+(api/async_views.py): воркер держит много запросов одновременно,
+а с БД работает пулом из ASYNC_DB_THREADS потоков.
+"""
+import os
+
+mode = os.getenv('SERVER_MODE', 'sync')
+if mode not in ('sync', 'async'):
+    raise ValueError(f'SERVER_MODE должен быть sync или async, а не {mode}')
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', 1))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+
+if mode == 'async':
+    wsgi_app = 'foodgram.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'foodgram.wsgi:application'
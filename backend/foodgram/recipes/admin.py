@@ -1,8 +1,12 @@
 from django.contrib import admin
-from django.contrib.admin import display
+from django.db import transaction
 
+from .fulltext import update_search_index
+from .images import delete_variant_files, schedule_image_variants
 from .models import (Favorite, Ingredient, IngredientInRecipe, Recipes,
                      ShopCart, Tags)
+from .shopping_list import add_recipes, remove_recipes
+from .toggles import LINKS, adjust_counters
 
 
 class RecipeIngredintInline(admin.TabularInline):
@@ -24,21 +28,83 @@ class TagAdmin(admin.ModelAdmin):
 
 @admin.register(Recipes)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('name', )
+    list_display = ('name', 'favorites_count')
     list_filter = ('author', 'name', 'tags',)
-    readonly_fields = ('added_to_favorite',)
+    readonly_fields = ('favorites_count', 'in_carts_count')
     inlines = (RecipeIngredintInline, )
 
-    @display(description='Добавлений в избранное')
-    def added_to_favorite(self, obj):
-        return obj.favorite.count()
+    def save_model(self, request, obj, form, change):
+        # Как в RecipeCreateSerializer: варианты старого изображения
+        # удаляются, новые строятся после коммита.
+        image_changed = not change or 'image' in form.changed_data
+        if change and image_changed:
+            stale = list(obj.image_variants.values())
+            obj.image_variants = {}
+            transaction.on_commit(lambda: delete_variant_files(stale))
+        super().save_model(request, obj, form, change)
+        if image_changed:
+            schedule_image_variants(obj)
+
+    def save_related(self, request, form, formsets, change):
+        remove_recipes([form.instance.pk])
+        super().save_related(request, form, formsets, change)
+        add_recipes([form.instance.pk])
+        update_search_index([form.instance.pk])
+
+
+class LinkAdmin(admin.ModelAdmin):
+    """Связи пользователя (избранное, корзина, подписки) учитываются
+    в счётчиках так же, как при изменении через API."""
+
+    def has_change_permission(self, request, obj=None):
+        # Перенос связи на другой объект — это удаление и добавление.
+        return False
+
+    def target_ids(self, links):
+        return [getattr(link, f'{LINKS[self.model][1]}_id') for link in links]
+
+    def links_added(self, links):
+        adjust_counters(self.model, self.target_ids(links), 1)
+
+    def links_removed(self, links):
+        adjust_counters(self.model, self.target_ids(links), -1)
+
+    @transaction.atomic
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        self.links_added([obj])
+
+    @transaction.atomic
+    def delete_model(self, request, obj):
+        self.links_removed([obj])
+        super().delete_model(request, obj)
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        self.links_removed(list(queryset))
+        super().delete_queryset(request, queryset)
 
 
 @admin.register(Favorite)
-class FavoriteAdmin(admin.ModelAdmin):
+class FavoriteAdmin(LinkAdmin):
     list_display = ('author', 'recipe')
 
 
 @admin.register(ShopCart)
-class ShopCarteAdmin(admin.ModelAdmin):
+class ShopCarteAdmin(LinkAdmin):
+    """Вместе с корзиной меняется и список покупок пользователя."""
+
     list_display = ('author', 'recipe')
+
+    def links_added(self, links):
+        super().links_added(links)
+        for link in links:
+            add_recipes([link.recipe_id], link.author_id)
+
+    def links_removed(self, links):
+        super().links_removed(links)
+        recipes = {}
+        for link in links:
+            recipes.setdefault(link.author_id, []).append(link.recipe_id)
+        for user_id, recipe_ids in recipes.items():
+            remove_recipes(recipe_ids, user_id)
@@ -1,7 +1,15 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class RecipesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recipes'
     verbose_name = 'Рецепты'
+
+    def ready(self):
+        from recipes import signals  # noqa: F401
+        from recipes.fulltext import create_search_indexes
+        from recipes.search import create_trigram_indexes
+        post_migrate.connect(create_trigram_indexes, sender=self)
+        post_migrate.connect(create_search_indexes, sender=self)
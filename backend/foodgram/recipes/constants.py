@@ -4,3 +4,11 @@ COOKING_TIME_MIN = 1
 COOKING_TIME_MAX = 32000
 RECIPE_NAME_AND_TAGS = 200
 TAG_COLOR = 7
+INGREDIENT_SEARCH_LIMIT = 20
+INGREDIENT_SEARCH_SIMILARITY = 0.3
+IMAGE_WIDTHS = (320, 640, 1280)
+IMAGE_QUALITY = 80
+RECIPES_LIMIT_MAX = 100
+SEARCH_HEADLINE_WORDS = 16
+SEARCH_RESULTS_MAX = 1000
+BULK_TOGGLE_MAX = 100
@@ -0,0 +1,209 @@
+"""Полнотекстовый поиск рецептов по названию, описанию и ингредиентам.
+
+На PostgreSQL поиск идёт по полю Recipes.search_vector с GIN-индексом,
+на SQLite (тесты) — по виртуальной таблице FTS5. Индекс обновляется
+функцией update_search_index() при каждом изменении рецепта или его
+ингредиентов.
+
+Совпадения во фрагменте описания (search_headline) отмечаются
+управляющими символами: текст рецепта вводит пользователь, поэтому
+render_headline() сначала экранирует фрагмент и только потом
+превращает отметки в теги <b>.
+"""
+from html import escape
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchHeadline, SearchQuery,
+                                            SearchRank, SearchVector)
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+from django.db.models import (Case, CharField, Count, F, FloatField, OuterRef,
+                              Subquery, Value, When)
+from django.db.models.functions import Coalesce
+
+from recipes import constants
+from recipes.models import IngredientInRecipe, Recipes
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'recipes_recipes_fts'
+HEADLINE_START = '\x02'
+HEADLINE_STOP = '\x03'
+
+POSTGRES_INDEXES_SQL = (
+    'CREATE INDEX IF NOT EXISTS recipes_recipes_search_vector_gin '
+    'ON recipes_recipes USING gin (search_vector)',
+)
+SQLITE_INDEXES_SQL = (
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+    'USING fts5(name, text, ingredients)',
+)
+
+
+def ingredient_names():
+    """Подзапрос с названиями ингредиентов рецепта через пробел."""
+    return Subquery(
+        IngredientInRecipe.objects.filter(recipe=OuterRef('pk')).order_by(
+        ).values('recipe').annotate(
+            names=StringAgg('ingredient__name', ' ')
+        ).values('names')
+    )
+
+
+def update_search_index(recipe_ids, using='default'):
+    """Пересчитывает поисковый индекс для перечисленных рецептов."""
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+    vendor = connections[using].vendor
+    if vendor == 'postgresql':
+        Recipes.objects.using(using).filter(pk__in=recipe_ids).update(
+            search_vector=(
+                SearchVector('name', weight='A', config=SEARCH_CONFIG)
+                + SearchVector(
+                    ingredient_names(), weight='B', config=SEARCH_CONFIG)
+                + SearchVector('text', weight='C', config=SEARCH_CONFIG)
+            )
+        )
+    elif vendor == 'sqlite':
+        names = {}
+        for recipe_id, name in IngredientInRecipe.objects.using(using).filter(
+            recipe__in=recipe_ids
+        ).values_list('recipe_id', 'ingredient__name'):
+            names.setdefault(recipe_id, []).append(name)
+        rows = [
+            (pk, name, text, ' '.join(names.get(pk, ())))
+            for pk, name, text in Recipes.objects.using(using).filter(
+                pk__in=recipe_ids).values_list('pk', 'name', 'text')
+        ]
+        with connections[using].cursor() as cursor:
+            remove_from_sqlite_index(cursor, recipe_ids)
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, text, ingredients) '
+                'VALUES (%s, %s, %s, %s)', rows)
+
+
+def remove_from_sqlite_index(cursor, recipe_ids):
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    cursor.execute(
+        f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})',
+        recipe_ids)
+
+
+def render_headline(headline):
+    """HTML фрагмента: экранированный текст с совпадениями в <b>."""
+    return escape(headline).replace(
+        HEADLINE_START, '<b>').replace(HEADLINE_STOP, '</b>')
+
+
+def search_recipes(queryset, query):
+    """Фильтрует рецепты по запросу и добавляет search_rank.
+
+    Фрагмент описания с подсвеченными словами (search_headline) на
+    SQLite приходит из того же запроса FTS5, а на PostgreSQL его
+    добавляет add_headlines() уже для рецептов страницы.
+    """
+    if connections[queryset.db].vendor == 'postgresql':
+        return _search_postgres(queryset, query)
+    return _search_sqlite(queryset, query)
+
+
+def websearch_query(query):
+    return SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+
+
+def _search_postgres(queryset, query):
+    search_query = websearch_query(query)
+    return queryset.filter(search_vector=search_query).annotate(
+        search_rank=SearchRank(F('search_vector'), search_query))
+
+
+def add_headlines(recipes, query, using='default'):
+    """Добавляет search_headline рецептам страницы одним запросом.
+
+    ts_headline — самая дорогая часть поиска, поэтому она считается
+    не в выборке (и COUNT пагинации), а только для показанных строк.
+    """
+    if connections[using].vendor != 'postgresql' or not recipes:
+        return
+    headlines = dict(Recipes.objects.using(using).filter(
+        pk__in=[recipe.pk for recipe in recipes]
+    ).annotate(search_headline=SearchHeadline(
+        'text', websearch_query(query), config=SEARCH_CONFIG,
+        start_sel=HEADLINE_START, stop_sel=HEADLINE_STOP,
+        max_words=constants.SEARCH_HEADLINE_WORDS,
+    )).values_list('pk', 'search_headline'))
+    for recipe in recipes:
+        recipe.search_headline = headlines.get(recipe.pk, '')
+
+
+def _search_sqlite(queryset, query):
+    nothing = queryset.annotate(
+        search_rank=Value(0.0, output_field=FloatField()),
+        search_headline=Value('', output_field=CharField()),
+    ).none()
+    words = query.split()
+    if not words:
+        return nothing
+    match = ' '.join(
+        '"{}"*'.format(word.replace('"', '""')) for word in words)
+    # Фильтры запроса (теги, автор, избранное) применяются до LIMIT,
+    # иначе лучшие результаты по всей базе вытеснят подходящие.
+    try:
+        ids_sql, ids_params = queryset.order_by().values(
+            'pk').query.sql_with_params()
+    except EmptyResultSet:
+        return nothing
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid, -bm25({FTS_TABLE}, 10.0, 1.0, 5.0), '
+            f"snippet({FTS_TABLE}, 1, %s, %s, '…', %s) "
+            f'FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+            f'AND rowid IN ({ids_sql}) '
+            f'ORDER BY bm25({FTS_TABLE}, 10.0, 1.0, 5.0) LIMIT %s',
+            (HEADLINE_START, HEADLINE_STOP, constants.SEARCH_HEADLINE_WORDS,
+             match, *ids_params, constants.SEARCH_RESULTS_MAX)
+        )
+        found = cursor.fetchall()
+    if not found:
+        return nothing
+    return queryset.filter(pk__in=[pk for pk, _, _ in found]).annotate(
+        search_rank=Case(
+            *[When(pk=pk, then=Value(rank)) for pk, rank, _ in found],
+            output_field=FloatField(),
+        ),
+        search_headline=Case(
+            *[When(pk=pk, then=Value(headline)) for pk, _, headline in found],
+            output_field=CharField(),
+        ),
+    )
+
+
+def with_ingredient_overlap(queryset, ingredient_ids):
+    """Рецепты, в которых есть хотя бы один из ингредиентов.
+
+    matched_ingredients — сколько из них есть в рецепте,
+    missing_ingredients — сколько ещё ингредиентов придётся докупить.
+    """
+    def count(rows):
+        return Coalesce(Subquery(
+            rows.order_by().values('recipe').annotate(
+                total=Count('pk')).values('total')
+        ), 0)
+
+    rows = IngredientInRecipe.objects.filter(recipe=OuterRef('pk'))
+    return queryset.annotate(
+        matched_ingredients=count(rows.filter(ingredient__in=ingredient_ids)),
+        missing_ingredients=count(rows.exclude(ingredient__in=ingredient_ids)),
+    ).filter(matched_ingredients__gt=0)
+
+
+def create_search_indexes(using='default', **kwargs):
+    """Создаёт GIN-индекс (PostgreSQL) или таблицу FTS5 (SQLite)."""
+    db = connections[using]
+    statements = {
+        'postgresql': POSTGRES_INDEXES_SQL,
+        'sqlite': SQLITE_INDEXES_SQL,
+    }.get(db.vendor, ())
+    with db.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
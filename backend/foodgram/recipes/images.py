@@ -0,0 +1,99 @@
+"""Уменьшенные копии изображений рецептов.
+
+После сохранения рецепта оригинал перекодируется в WebP нескольких
+ширин в пуле потоков, чтобы не задерживать ответ на запрос. Готовые
+варианты записываются в Recipes.image_variants и отдаются клиенту
+в виде srcset. Варианты прежнего изображения удаляются, когда готовы
+новые, а при удалении рецепта — вместе с ним (recipes.signals).
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from recipes import constants
+from recipes.models import Recipes
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.RECIPE_IMAGE_WORKERS,
+            thread_name_prefix='recipe-images',
+        )
+    return _executor
+
+
+def schedule_image_variants(recipe):
+    """Ставит в очередь построение вариантов после коммита транзакции."""
+    args = (recipe.pk, recipe.image.name)
+    if not settings.RECIPE_IMAGE_WORKERS:
+        transaction.on_commit(lambda: build_image_variants_safely(*args))
+        return
+    transaction.on_commit(
+        lambda: get_executor().submit(build_image_variants_task, *args))
+
+
+def build_image_variants_safely(pk, name):
+    """Рецепт уже сохранён: ошибка обработки попадает только в лог."""
+    try:
+        build_image_variants(pk, name)
+    except Exception:
+        logger.exception('Не удалось обработать изображение %s', name)
+
+
+def build_image_variants_task(pk, name):
+    try:
+        build_image_variants_safely(pk, name)
+    finally:
+        connection.close()
+
+
+def delete_variant_files(names):
+    for name in names:
+        try:
+            default_storage.delete(name)
+        except OSError:
+            logger.exception('Не удалось удалить вариант изображения %s',
+                             name)
+
+
+def build_image_variants(pk, name):
+    with default_storage.open(name) as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image = image.convert(
+            'RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+    path = PurePosixPath(name)
+    variants = {}
+    for width in sorted({
+        min(width, image.width) for width in constants.IMAGE_WIDTHS
+    }):
+        variant = image.copy()
+        variant.thumbnail((width, image.height))
+        buffer = BytesIO()
+        variant.save(
+            buffer, 'WEBP', quality=constants.IMAGE_QUALITY, method=4)
+        variants[str(width)] = default_storage.save(
+            str(path.parent / 'variants' / f'{path.stem}_{width}.webp'),
+            ContentFile(buffer.getvalue()),
+        )
+    recipe = Recipes.objects.filter(pk=pk, image=name)
+    previous = recipe.values_list('image_variants', flat=True).first()
+    if not recipe.update(image_variants=variants, updated_at=timezone.now()):
+        # Изображение успели заменить или рецепт удалили.
+        delete_variant_files(variants.values())
+        return
+    delete_variant_files(
+        set((previous or {}).values()) - set(variants.values()))
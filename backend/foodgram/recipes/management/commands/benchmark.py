@@ -0,0 +1,159 @@
+import json
+import math
+import subprocess
+import time
+from pathlib import Path
+from statistics import mean
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+
+from recipes.models import Ingredient, Recipes, Tags
+from users.models import User
+
+# Имя замера и адрес; в фигурных скобках — параметры из данных в БД.
+ENDPOINTS = (
+    ('recipe_list', '/api/recipes/?limit=6'),
+    ('recipe_list_filtered',
+     '/api/recipes/?limit=6&tags={tag}&is_favorited=1'),
+    ('recipe_detail', '/api/recipes/{recipe}/'),
+    ('subscriptions', '/api/users/subscriptions/?limit=6&recipes_limit=3'),
+    ('shopping_list', '/api/recipes/download_shopping_cart/'),
+    ('ingredient_search', '/api/ingredients/?name={ingredient}'),
+)
+
+
+def percentile(values, percent):
+    """Перцентиль по методу ближайшего ранга."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ('git', 'rev-parse', '--short', 'HEAD'), capture_output=True,
+            text=True, check=True, cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    """Замер основных эндпоинтов API внутри процесса.
+
+    Запросы идут через тестовый клиент DRF от имени одного пользователя,
+    поэтому сеть и сервер приложений в замер не попадают. Результат —
+    JSON с p50/p95 времени ответа и числом запросов к БД, который можно
+    сравнить с результатом другого коммита через --baseline.
+    Данные для замеров создаёт команда generate_data.
+    """
+
+    help = 'Замеряет время ответа и число запросов основных эндпоинтов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument(
+            '--warmup', type=int, default=5,
+            help='Запросы до замера, прогревают кэши.')
+        parser.add_argument(
+            '--user', help='Email пользователя, по умолчанию — '
+                           'пользователь с самой большой корзиной.')
+        parser.add_argument(
+            '--only', nargs='+', choices=[name for name, _ in ENDPOINTS])
+        parser.add_argument('--output', help='Файл для результата.')
+        parser.add_argument(
+            '--baseline', help='Результат прошлого замера для сравнения.')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations должен быть больше нуля.')
+        user = self.get_user(options['user'])
+        params = self.get_params(user)
+        client = APIClient()
+        client.force_authenticate(user)
+        results = {}
+        with override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for name, url in ENDPOINTS:
+                if options['only'] and name not in options['only']:
+                    continue
+                results[name] = self.measure(
+                    client, url.format(**params),
+                    options['warmup'], options['iterations'])
+        report = {
+            'commit': current_commit(),
+            'database': connection.vendor,
+            'iterations': options['iterations'],
+            'user': user.pk,
+            'recipes': Recipes.objects.count(),
+            'results': results,
+        }
+        if options['baseline']:
+            report['delta'] = self.compare(results, options['baseline'])
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            Path(options['output']).write_text(output + '\n')
+        self.stdout.write(output)
+
+    def get_user(self, email):
+        if email:
+            user = User.objects.filter(email=email).first()
+        else:
+            user = User.objects.annotate(
+                carts=Count('shop')).order_by('-carts', 'pk').first()
+        if user is None:
+            raise CommandError(
+                'Пользователь не найден, создайте данные generate_data.')
+        return user
+
+    def get_params(self, user):
+        recipe = Recipes.objects.order_by('-favorites_count').first()
+        tag = Tags.objects.first()
+        ingredient = Ingredient.objects.first()
+        if recipe is None or tag is None or ingredient is None:
+            raise CommandError('Нет данных, запустите generate_data.')
+        return {
+            'recipe': recipe.pk,
+            'tag': tag.slug,
+            'ingredient': ingredient.name[:3],
+        }
+
+    def measure(self, client, url, warmup, iterations):
+        timings, queries = [], []
+        for number in range(warmup + iterations):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = client.get(url)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                elapsed = time.perf_counter() - started
+            if response.status_code != 200:
+                raise CommandError(f'{url}: ответ {response.status_code}')
+            if number >= warmup:
+                timings.append(elapsed * 1000)
+                queries.append(len(captured))
+        return {
+            'url': url,
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'mean_ms': round(mean(timings), 3),
+            'queries': max(queries),
+        }
+
+    def compare(self, results, path):
+        try:
+            baseline = json.loads(Path(path).read_text())['results']
+        except (OSError, ValueError, KeyError) as error:
+            raise CommandError(f'Не удалось прочитать {path}: {error}')
+        return {
+            name: {
+                key: round(result[key] - baseline[name][key], 3)
+                for key in ('p50_ms', 'p95_ms', 'queries')
+            }
+            for name, result in results.items() if name in baseline
+        }
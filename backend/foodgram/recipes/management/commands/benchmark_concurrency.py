@@ -0,0 +1,243 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from threading import Lock
+
+from django.conf import settings
+from django.core.management.base import CommandError
+from django.db import close_old_connections, connection, connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+
+from api.async_views import get_async_settings
+from recipes.management.commands import benchmark
+
+ENDPOINTS = (
+    ('recipe_list', '/api/recipes/?limit=6'),
+    ('recipe_detail', '/api/recipes/{recipe}/'),
+    ('ingredient_search', '/api/ingredients/?name={ingredient}'),
+    ('tags', '/api/tags/'),
+)
+MODES = ('sync', 'async')
+
+
+def split(total, parts):
+    """total запросов поровну между parts клиентами."""
+    return [total // parts + (number < total % parts)
+            for number in range(parts)]
+
+
+def add_latency(seconds):
+    """Задержка перед каждым запросом к БД во всех потоках процесса."""
+    def delay(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+
+    def install(connection, **kwargs):
+        if delay not in connection.execute_wrappers:
+            connection.execute_wrappers.insert(0, delay)
+
+    connection_created.connect(install, weak=False)
+    for existing in connections.all():
+        install(existing)
+
+
+@contextmanager
+def temporary_token(user):
+    """Токен пользователя; созданный для замера удаляется после него."""
+    token, created = Token.objects.get_or_create(user=user)
+    try:
+        yield token
+    finally:
+        if created:
+            token.delete()
+
+
+class Command(benchmark.Command):
+    """Сравнение синхронного и асинхронного режимов одного воркера.
+
+    Команда запускает себя в двух процессах: с ASYNC_VIEWS_ENABLED=False
+    и True. Синхронный воркер gunicorn обслуживает запросы по одному,
+    поэтому в синхронном режиме клиенты-потоки проходят через общую
+    блокировку. В асинхронном режиме клиенты — задачи одного цикла
+    событий, а запросы идут через AsyncClient, то есть через тот же
+    асинхронный обработчик, что и под ASGI. Для каждого числа клиентов
+    замеряются пропускная способность и p50/p95 времени ответа.
+
+    У локальной базы почти нет сетевой задержки, поэтому --latency
+    добавляет паузу к каждому запросу к БД: именно ожидание БД
+    асинхронный режим и позволяет перекрывать.
+    """
+
+    help = ('Сравнивает пропускную способность воркера в синхронном '
+            'и асинхронном режимах.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help='Запросов на эндпоинт при каждом числе клиентов.')
+        parser.add_argument(
+            '--concurrency', type=int, nargs='+', default=(1, 8, 32),
+            help='Числа одновременных клиентов.')
+        parser.add_argument(
+            '--latency', type=float, default=5,
+            help='Задержка каждого запроса к БД, мс.')
+        parser.add_argument(
+            '--anonymous', action='store_true',
+            help='Запросы без токена.')
+        parser.add_argument('--user', help='Email пользователя.')
+        parser.add_argument(
+            '--only', nargs='+', choices=[name for name, _ in ENDPOINTS])
+        parser.add_argument('--output', help='Файл для результата.')
+        parser.add_argument(
+            '--mode', choices=MODES,
+            help='Замерить только режим текущего процесса.')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or min(options['concurrency']) < 1:
+            raise CommandError(
+                '--requests и --concurrency должны быть больше нуля.')
+        if options['mode']:
+            self.stdout.write(json.dumps(self.measure_mode(options)))
+            return
+        modes = {mode: self.run_mode(mode, options) for mode in MODES}
+        report = {
+            'commit': benchmark.current_commit(),
+            'database': connection.vendor,
+            'latency_ms': options['latency'],
+            'db_threads': get_async_settings()['DB_THREADS'],
+            'requests': options['requests'],
+            'results': modes,
+            'speedup': {
+                name: {
+                    level: round(
+                        result[level]['rps']
+                        / modes['sync'][name][level]['rps'], 2)
+                    for level in result
+                }
+                for name, result in modes['async'].items()
+            },
+        }
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            Path(options['output']).write_text(output + '\n')
+        self.stdout.write(output)
+
+    def run_mode(self, mode, options):
+        """Замер режима mode в отдельном процессе."""
+        arguments = [
+            sys.executable, str(settings.BASE_DIR / 'manage.py'),
+            'benchmark_concurrency', '--mode', mode,
+            '--requests', str(options['requests']),
+            '--latency', str(options['latency']),
+            '--concurrency', *map(str, options['concurrency']),
+        ]
+        if options['anonymous']:
+            arguments.append('--anonymous')
+        if options['user']:
+            arguments.extend(('--user', options['user']))
+        if options['only']:
+            arguments.extend(('--only', *options['only']))
+        process = subprocess.run(
+            arguments, capture_output=True, text=True,
+            env={**os.environ, 'ASYNC_VIEWS_ENABLED': str(mode == 'async')},
+        )
+        if process.returncode:
+            raise CommandError(
+                f'Замер режима {mode} не удался:\n{process.stderr}')
+        return json.loads(process.stdout.splitlines()[-1])
+
+    def measure_mode(self, options):
+        mode = 'async' if get_async_settings()['ENABLED'] else 'sync'
+        if mode != options['mode']:
+            raise CommandError(
+                f'Процесс работает в режиме {mode}, а не {options["mode"]}.')
+        user = self.get_user(options['user'])
+        params = self.get_params(user)
+        headers = {}
+        if options['latency']:
+            add_latency(options['latency'] / 1000)
+        results = {}
+        with ExitStack() as stack:
+            if not options['anonymous']:
+                token = stack.enter_context(temporary_token(user))
+                headers['authorization'] = f'Token {token.key}'
+            stack.enter_context(override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']))
+            for name, url in ENDPOINTS:
+                if options['only'] and name not in options['only']:
+                    continue
+                url = url.format(**params)
+                results[name] = {
+                    str(level): self.measure_level(
+                        mode, url, headers, options['requests'], level)
+                    for level in options['concurrency']
+                }
+        return results
+
+    def measure_level(self, mode, url, headers, total, concurrency):
+        if mode == 'async':
+            timings, elapsed = asyncio.run(
+                self.run_async(url, headers, total, concurrency))
+        else:
+            timings, elapsed = self.run_sync(
+                url, headers, total, concurrency)
+        return {
+            'rps': round(total / elapsed, 1),
+            'p50_ms': round(benchmark.percentile(timings, 50) * 1000, 3),
+            'p95_ms': round(benchmark.percentile(timings, 95) * 1000, 3),
+        }
+
+    def run_sync(self, url, headers, total, concurrency):
+        worker = Lock()
+        timings = []
+        extra = {
+            f'HTTP_{name.upper()}': value for name, value in headers.items()}
+
+        def client(count):
+            session = Client()
+            try:
+                for _ in range(count):
+                    started = time.perf_counter()
+                    with worker:
+                        response = session.get(url, **extra)
+                        # Тестовый клиент не закрывает соединения после
+                        # запроса, а настоящий воркер закрывает.
+                        close_old_connections()
+                    timings.append(time.perf_counter() - started)
+                    self.check_response(url, response)
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as clients:
+            list(clients.map(client, split(total, concurrency)))
+        return timings, time.perf_counter() - started
+
+    async def run_async(self, url, headers, total, concurrency):
+        timings = []
+
+        async def client(count):
+            session = AsyncClient()
+            for _ in range(count):
+                started = time.perf_counter()
+                response = await session.get(url, **headers)
+                timings.append(time.perf_counter() - started)
+                self.check_response(url, response)
+
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(client(count) for count in split(total, concurrency)))
+        return timings, time.perf_counter() - started
+
+    def check_response(self, url, response):
+        if response.status_code != 200:
+            raise CommandError(f'{url}: ответ {response.status_code}')
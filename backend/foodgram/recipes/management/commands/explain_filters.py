@@ -0,0 +1,125 @@
+import json
+import re
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.filters import RecipeFilter
+from recipes.models import Recipes, ShoppingListItem, Tags
+from users.models import User
+
+SQLITE_FULL_SCAN = re.compile(r'\bSCAN (\w+)\b(?! USING)')
+POSTGRESQL_INDEX_SCANS = ('Index Scan', 'Index Only Scan')
+
+
+def recipe_filter(user, **params):
+    """Выборка рецептов тем же RecipeFilter, что и в API."""
+    return RecipeFilter(
+        params, queryset=Recipes.objects.all(),
+        request=SimpleNamespace(user=user)).qs
+
+
+def filter_paths(user):
+    """Запросы API, которые должны обслуживаться индексами."""
+    return {
+        # Один тег: фильтр по большинству тегов честно читает всю таблицу.
+        'recipes?tags': recipe_filter(user, tags=list(
+            Tags.objects.order_by('pk').values_list('slug', flat=True)[:1])),
+        'recipes?author': recipe_filter(user, author=user.pk),
+        'recipes?is_favorited': recipe_filter(user, is_favorited=True),
+        'recipes?is_in_shopping_cart': recipe_filter(
+            user, is_in_shopping_cart=True),
+        'recipes/download_shopping_cart': ShoppingListItem.objects.filter(
+            user=user
+        ).values(
+            'ingredient__name', 'ingredient__measurement_unit', 'amount'
+        ),
+        'users/subscriptions': User.objects.filter(
+            following__user=user),
+    }
+
+
+def plan_nodes(node):
+    yield node
+    for child in node.get('Plans', ()):
+        yield from plan_nodes(child)
+
+
+def postgresql_full_scans(queryset):
+    """Таблицы, прочитанные целиком: Seq Scan или обход индекса без
+    условия (Index Scan без Index Cond читает весь индекс)."""
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return {
+        node['Relation Name'] for node in plan_nodes(plan[0]['Plan'])
+        if node['Node Type'] == 'Seq Scan'
+        or node['Node Type'] in POSTGRESQL_INDEX_SCANS
+        and 'Index Cond' not in node
+    }
+
+
+def sqlite_full_scans(queryset):
+    return set(SQLITE_FULL_SCAN.findall(queryset.explain()))
+
+
+FULL_SCANS = {
+    'postgresql': postgresql_full_scans,
+    'sqlite': sqlite_full_scans,
+}
+
+
+class Command(BaseCommand):
+    """Проверка планов запросов для горячих фильтров API.
+
+    Для каждого пути выполняется EXPLAIN и ищутся полные просмотры таблиц.
+    На PostgreSQL последовательное сканирование запрещается на время
+    проверки, поэтому Seq Scan в плане означает отсутствие индекса;
+    полным считается и обход индекса без условия. Планы имеют смысл
+    только на данных, близких к боевым (generate_data), со свежей
+    статистикой: --analyze обновляет её перед проверкой.
+    """
+
+    help = 'Проверяет, что фильтры API используют индексы.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verbose-plans', action='store_true',
+            help='Печатать планы целиком.')
+        parser.add_argument(
+            '--analyze', action='store_true',
+            help='Обновить статистику планировщика перед проверкой.')
+
+    def handle(self, *args, **options):
+        full_scans = FULL_SCANS.get(connection.vendor)
+        if full_scans is None:
+            raise CommandError(
+                f'База {connection.vendor} не поддерживается.')
+        user = User.objects.order_by('pk').first()
+        if user is None:
+            raise CommandError(
+                'База пуста, заполните её командой generate_data.')
+        failures = []
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                if options['analyze']:
+                    cursor.execute('ANALYZE')
+                if connection.vendor == 'postgresql':
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            for name, queryset in filter_paths(user).items():
+                scans = sorted(full_scans(queryset))
+                if options['verbose_plans']:
+                    self.stdout.write(f'{name}:\n{queryset.explain()}\n')
+                if scans:
+                    failures.append(name)
+                    self.stdout.write(self.style.ERROR(
+                        f'{name}: полный просмотр {", ".join(scans)}'))
+                else:
+                    self.stdout.write(self.style.SUCCESS(f'{name}: OK'))
+        if failures:
+            raise CommandError(
+                f'Без индекса выполняются: {", ".join(failures)}')
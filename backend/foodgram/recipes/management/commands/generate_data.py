@@ -0,0 +1,206 @@
+import random
+from io import BytesIO
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from PIL import Image
+
+from recipes.management.commands.create_tags import create_tags
+from recipes.management.commands.load_csv import batches
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipes,
+                            ShopCart, Tags)
+from recipes.signals import ingredients_imported
+from users.models import Follow, User
+
+BATCH_SIZE = 1000
+IMAGE_NAME = 'recipes/images/generated.png'
+# Домен почты созданных пользователей: по нему --clear отличает их от
+# настоящих аккаунтов с тем же префиксом имени.
+EMAIL_DOMAIN = 'generated.foodgram.invalid'
+MIN_INGREDIENTS = 30
+UNITS = ('г', 'кг', 'мл', 'л', 'шт.', 'ст. л.', 'ч. л.', 'по вкусу')
+
+
+def generated_users(prefix):
+    return User.objects.filter(
+        username__startswith=prefix, email__endswith=f'@{EMAIL_DOMAIN}')
+
+
+class Command(BaseCommand):
+    """Генерация синтетических данных для нагрузочных замеров.
+
+    Популярность авторов и рецептов распределена по закону Ципфа:
+    немногие авторы пишут большую часть рецептов и собирают большую
+    часть подписок и добавлений в избранное. Все строки вставляются
+    пачками через bulk_create, счётчики, поисковый индекс и списки
+    покупок пересчитываются в конце.
+    """
+
+    help = 'Создаёт пользователей, рецепты, подписки, избранное и корзины.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument(
+            '--ingredients', type=int, nargs=2, default=(5, 30),
+            metavar=('MIN', 'MAX'),
+            help='Число ингредиентов в рецепте, от и до.')
+        parser.add_argument(
+            '--follows', type=int, default=10,
+            help='Подписок на пользователя в среднем.')
+        parser.add_argument(
+            '--favorites', type=int, default=20,
+            help='Рецептов в избранном на пользователя в среднем.')
+        parser.add_argument(
+            '--carts', type=int, default=5,
+            help='Рецептов в корзине на пользователя в среднем.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--prefix', default='bench',
+            help='Префикс имён созданных пользователей.')
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Сначала удалить созданных командой пользователей '
+                 'с этим префиксом.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        low, high = options['ingredients']
+        if options['users'] < 1 or not 1 <= low <= high:
+            raise CommandError('Проверьте --users и --ingredients.')
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        prefix = options['prefix']
+        generated = generated_users(prefix)
+        if options['clear']:
+            generated.delete()
+        elif generated.exists():
+            raise CommandError(
+                f'Пользователи с префиксом {prefix} уже есть, '
+                'используйте --clear или другой --prefix.')
+        if User.objects.filter(username__in=[
+                f'{prefix}{number}' for number in range(options['users'])
+        ]).exists():
+            raise CommandError(
+                f'Имена с префиксом {prefix} заняты настоящими '
+                'пользователями, используйте другой --prefix.')
+        with transaction.atomic():
+            tags, ingredients = self.prepare_references()
+            users = self.create_users(prefix, options['users'])
+            recipes = self.create_recipes(
+                users, options['recipes'], tags, ingredients, low, high)
+            self.create_links(
+                Follow, 'user_id', 'author_id', users, users,
+                options['follows'])
+            self.create_links(
+                Favorite, 'author_id', 'recipe_id', users, recipes,
+                options['favorites'])
+            self.create_links(
+                ShopCart, 'author_id', 'recipe_id', users, recipes,
+                options['carts'])
+        call_command('reconcile_counters', stdout=self.stdout)
+        call_command('update_search_index', stdout=self.stdout)
+        call_command('rebuild_shopping_lists', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(users)}, рецептов: {len(recipes)}'
+        ))
+
+    def prepare_references(self):
+        if not Tags.objects.exists():
+            create_tags()
+        existing = Ingredient.objects.count()
+        if existing < MIN_INGREDIENTS:
+            Ingredient.objects.bulk_create(
+                [Ingredient(name=f'Ингредиент {number}',
+                            measurement_unit=self.rng.choice(UNITS))
+                 for number in range(existing, MIN_INGREDIENTS)],
+                ignore_conflicts=True,
+            )
+            transaction.on_commit(
+                lambda: ingredients_imported.send(sender=Ingredient))
+        if not default_storage.exists(IMAGE_NAME):
+            buffer = BytesIO()
+            Image.new('RGB', (640, 480), (230, 160, 90)).save(buffer, 'PNG')
+            default_storage.save(IMAGE_NAME, ContentFile(buffer.getvalue()))
+        return (list(Tags.objects.values_list('pk', flat=True)),
+                list(Ingredient.objects.values_list('pk', flat=True)))
+
+    def create_users(self, prefix, count):
+        password = make_password(prefix)
+        self.bulk_create(User, (
+            User(username=f'{prefix}{number}',
+                 email=f'{prefix}{number}@{EMAIL_DOMAIN}',
+                 first_name='Тест', last_name=f'Пользователь {number}',
+                 password=password)
+            for number in range(count)
+        ))
+        return list(generated_users(prefix).order_by('pk').values_list(
+            'pk', flat=True))
+
+    def create_recipes(self, users, count, tags, ingredients, low, high):
+        authors = self.zipf(users, count)
+        self.bulk_create(Recipes, (
+            Recipes(author_id=author, name=f'Рецепт {number}',
+                    text=f'Описание рецепта {number}. ' * 5,
+                    image=IMAGE_NAME,
+                    cooking_time=self.rng.randint(5, 180))
+            for number, author in enumerate(authors)
+        ))
+        recipes = list(Recipes.objects.filter(
+            author__in=users).order_by('pk').values_list('pk', flat=True))
+        self.bulk_create(Recipes.tags.through, (
+            Recipes.tags.through(recipes_id=recipe, tags_id=tag)
+            for recipe in recipes
+            for tag in self.rng.sample(
+                tags, self.rng.randint(1, len(tags)))
+        ))
+        high = min(high, len(ingredients))
+        self.bulk_create(IngredientInRecipe, (
+            IngredientInRecipe(recipe_id=recipe, ingredient_id=ingredient,
+                               amount=self.rng.randint(1, 500))
+            for recipe in recipes
+            for ingredient in self.rng.sample(
+                ingredients, self.rng.randint(min(low, high), high))
+        ))
+        return recipes
+
+    def create_links(self, model, owner, target, users, targets, average):
+        if not targets or average < 1:
+            return
+        weights = self.zipf_weights(targets)
+        rows = []
+        for user in users:
+            chosen = self.pick(
+                targets, weights, self.rng.randint(0, 2 * average))
+            chosen.discard(user if model is Follow else None)
+            rows.extend(
+                model(**{owner: user, target: pk}) for pk in chosen)
+        self.bulk_create(model, rows)
+
+    def bulk_create(self, model, objects):
+        for batch in batches(objects, self.batch_size):
+            model.objects.bulk_create(batch)
+
+    def zipf_weights(self, population):
+        ranks = list(range(1, len(population) + 1))
+        self.rng.shuffle(ranks)
+        return [1 / rank for rank in ranks]
+
+    def zipf(self, population, count):
+        return self.rng.choices(
+            population, self.zipf_weights(population), k=count)
+
+    def pick(self, population, weights, count):
+        """count разных элементов, популярные выпадают чаще."""
+        if count * 2 > len(population):
+            return set(self.rng.sample(
+                population, min(count, len(population))))
+        chosen = set()
+        while len(chosen) < count:
+            chosen.update(self.rng.choices(
+                population, weights, k=count - len(chosen)))
+        return chosen
@@ -1,25 +1,149 @@
 import csv
+import json
+import time
+from itertools import islice
+from pathlib import Path
 
-from django.core.management.base import BaseCommand
-from recipes.models import Ingredient
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import NAME_LIMIT, Ingredient
+from recipes.signals import ingredients_imported
+
+DEFAULT_PATH = './data/ingredients.csv'
+BATCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024
+FIELDNAMES = ('name', 'measurement_unit')
 
 
 class Command(BaseCommand):
-    """Загрузка данных в БД"""
+    """Загрузка ингредиентов в БД из CSV или JSON.
+
+    Файл читается потоком и вставляется пачками через bulk_create
+    в одной транзакции; уже существующие пары (название, единица)
+    пропускаются.
+    """
+
+    help = 'Загружает ингредиенты из CSV или JSON файла.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=DEFAULT_PATH)
+        parser.add_argument(
+            '--format', choices=('csv', 'json'),
+            help='Формат файла, по умолчанию — по расширению.')
+        parser.add_argument(
+            '--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Показать новые ингредиенты, ничего не записывая.')
+
     def handle(self, *args, **options):
+        path = Path(options['path'])
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format not in ('csv', 'json'):
+            raise CommandError(f'Неизвестный формат файла: {path}')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть больше нуля.')
+        reader = read_csv if file_format == 'csv' else read_json
+        started = time.monotonic()
         try:
-            ingredients_load()
-            print('ингредиенты загружены')
-        except Exception as er:
-            print(er)
-
-
-def ingredients_load():
-    with open('./data/ingredients.csv',
-              encoding='utf-8') as csv_file:
-        fieldnames = ['name', 'measurement_unit']
-        csv_reader = csv.DictReader(csv_file, fieldnames=fieldnames)
-        for row in csv_reader:
-            Ingredient.objects.get_or_create(
-                name=row['name'],
-                measurement_unit=row['measurement_unit'])
+            with open(path, encoding='utf-8') as file:
+                rows = validate_rows(reader(file))
+                if options['dry_run']:
+                    total, created = self.diff(rows, options['batch_size'])
+                else:
+                    total, created = self.load(rows, options['batch_size'])
+        except OSError as error:
+            raise CommandError(f'Не удалось прочитать {path}: {error}')
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Будет добавлено" if options["dry_run"] else "Добавлено"}: '
+            f'{created} из {total} строк за {elapsed:.2f} с '
+            f'({total / elapsed if elapsed else total:.0f} строк/с)'
+        ))
+
+    @transaction.atomic
+    def load(self, rows, batch_size):
+        before = Ingredient.objects.count()
+        total = 0
+        for batch in batches(rows, batch_size):
+            Ingredient.objects.bulk_create(
+                [Ingredient(name=name, measurement_unit=unit)
+                 for name, unit in batch],
+                ignore_conflicts=True,
+            )
+            total += len(batch)
+        created = Ingredient.objects.count() - before
+        if created:
+            transaction.on_commit(
+                lambda: ingredients_imported.send(sender=Ingredient))
+        return total, created
+
+    def diff(self, rows, batch_size):
+        total = created = 0
+        # Повторы из разных пачек при загрузке вставятся один раз.
+        seen = set()
+        for batch in batches(rows, batch_size):
+            pairs = set(batch) - seen
+            seen |= pairs
+            existing = set(Ingredient.objects.filter(
+                name__in={name for name, _ in pairs}
+            ).values_list('name', 'measurement_unit'))
+            for name, unit in sorted(pairs - existing):
+                self.stdout.write(f'+ {name}, {unit}')
+                created += 1
+            total += len(batch)
+        return total, created
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def read_csv(file):
+    yield from csv.DictReader(file, fieldnames=FIELDNAMES)
+
+
+def read_json(file):
+    """Потоково разбирает JSON-массив объектов, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    for chunk in iter(lambda: file.read(CHUNK_SIZE), ''):
+        buffer += chunk
+        while True:
+            buffer = buffer.lstrip(' \t\r\n,')
+            if not buffer:
+                break
+            if not started:
+                if buffer[0] != '[':
+                    raise CommandError('Ожидается JSON-массив ингредиентов.')
+                buffer = buffer[1:]
+                started = True
+                continue
+            if buffer[0] == ']':
+                return
+            try:
+                row, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                break
+            buffer = buffer[end:]
+            yield row
+    raise CommandError('JSON-файл оборван или повреждён.')
+
+
+def validate_rows(rows):
+    for number, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            raise CommandError(f'Строка {number}: ожидается объект.')
+        name = (row.get('name') or '').strip()
+        unit = (row.get('measurement_unit') or '').strip()
+        if not name or not unit:
+            raise CommandError(
+                f'Строка {number}: не указано название или единица.')
+        if len(name) > NAME_LIMIT or len(unit) > NAME_LIMIT:
+            raise CommandError(
+                f'Строка {number}: длиннее {NAME_LIMIT} символов.')
+        yield name, unit
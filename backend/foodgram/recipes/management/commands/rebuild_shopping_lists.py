@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Exists, OuterRef
+
+from recipes.models import ShopCart, ShoppingListItem
+from recipes.shopping_list import rebuild
+from users.models import User
+
+
+class Command(BaseCommand):
+    """Пересчёт материализованных списков покупок по корзинам."""
+
+    help = 'Пересчитывает списки покупок всех или одного пользователя.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Email пользователя.')
+        parser.add_argument(
+            '--missing', action='store_true',
+            help='Только пользователи с корзиной, но без списка покупок.')
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options['user']:
+            user_ids = list(User.objects.filter(
+                email=options['user']).values_list('pk', flat=True))
+            if not user_ids:
+                raise CommandError('Пользователь не найден.')
+        elif options['missing']:
+            user_ids = list(User.objects.filter(
+                Exists(ShopCart.objects.filter(author=OuterRef('pk'))),
+                ~Exists(ShoppingListItem.objects.filter(user=OuterRef('pk'))),
+            ).values_list('pk', flat=True))
+        rebuild(user_ids)
+        items = ShoppingListItem.objects.all()
+        if user_ids is not None:
+            items = items.filter(user__in=user_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'Списки покупок пересчитаны, строк: {items.count()}'))
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipes, ShopCart
+from users.models import Follow, User
+
+
+def count_of(model, field):
+    """Подзапрос с числом строк model, ссылающихся на текущую запись."""
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+COUNTERS = (
+    (Recipes, {
+        'favorites_count': (Favorite, 'recipe'),
+        'in_carts_count': (ShopCart, 'recipe'),
+    }),
+    (User, {
+        'followers_count': (Follow, 'author'),
+        'recipes_count': (Recipes, 'author'),
+    }),
+)
+
+
+class Command(BaseCommand):
+    """Пересчёт денормализованных счётчиков по исходным таблицам."""
+
+    help = 'Исправляет расхождения счётчиков избранного, корзин и подписок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать число расхождений.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            for model, counters in COUNTERS:
+                actual = {
+                    counter: count_of(*source)
+                    for counter, source in counters.items()
+                }
+                drifted = model.objects.annotate(**{
+                    f'actual_{counter}': expression
+                    for counter, expression in actual.items()
+                }).filter(Q(*(
+                    ~Q(**{counter: F(f'actual_{counter}')})
+                    for counter in counters
+                ), _connector=Q.OR)).values_list('pk', flat=True)
+                drifted = list(drifted)
+                if drifted and not options['dry_run']:
+                    model.objects.filter(pk__in=drifted).update(**actual)
+                self.stdout.write(
+                    f'{model._meta.verbose_name_plural}: '
+                    f'расхождений {len(drifted)}'
+                )
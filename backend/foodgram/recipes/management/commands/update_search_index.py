@@ -0,0 +1,33 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+
+from recipes.fulltext import update_search_index
+from recipes.models import Recipes
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    """Перестроение поискового индекса рецептов."""
+
+    help = 'Пересчитывает поисковый индекс для всех рецептов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument(
+            '--missing', action='store_true',
+            help='Только рецепты без поискового вектора (PostgreSQL).')
+
+    def handle(self, *args, **options):
+        recipes = Recipes.objects.all()
+        if options['missing']:
+            recipes = recipes.filter(search_vector__isnull=True)
+        recipe_ids = recipes.order_by('pk').values_list(
+            'pk', flat=True).iterator()
+        total = 0
+        while batch := list(islice(recipe_ids, options['batch_size'])):
+            update_search_index(batch)
+            total += len(batch)
+        self.stdout.write(self.style.SUCCESS(
+            f'Поисковый индекс обновлён для {total} рецептов'))
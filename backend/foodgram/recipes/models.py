@@ -1,6 +1,10 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
-from django.db.models import UniqueConstraint
+from django.db.models import (BooleanField, Exists, F, OuterRef, Prefetch,
+                              UniqueConstraint, Value, Window)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
 
 from recipes import constants
 from users.models import User
@@ -18,6 +22,12 @@ class Ingredient(models.Model):
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
         ordering = ("name",)
+        constraints = [
+            UniqueConstraint(
+                fields=('name', 'measurement_unit'),
+                name='unique_ingredient_measurement_unit'
+            )
+        ]
 
     def __str__(self):
         return self.name
@@ -42,12 +52,76 @@ class Tags(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+
+    def with_user_flags(self, user):
+        """Аннотирует рецепты флагами избранного и корзины пользователя."""
+        if user.is_anonymous:
+            return self.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+            )
+        return self.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                author=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShopCart.objects.filter(
+                author=user, recipe=OuterRef('pk'))),
+        )
+
+    def for_read(self, user):
+        """Набор рецептов для чтения за фиксированное число запросов."""
+        return self.with_user_flags(user).prefetch_related(
+            'tags',
+            Prefetch(
+                'ingredient_list',
+                queryset=IngredientInRecipe.objects.select_related(
+                    'ingredient')
+            ),
+            Prefetch(
+                'author',
+                queryset=User.objects.with_is_subscribed(user)
+            ),
+        )
+
+    def with_versions(self):
+        """Только id, отметки изменения рецепта и автора и счётчики —
+        этого хватает, чтобы собрать ответ из кэша представлений."""
+        return self.only(
+            'id', 'author', 'updated_at', 'favorites_count', 'in_carts_count'
+        ).annotate(
+            author_updated_at=F('author__updated_at'),
+            author_followers_count=F('author__followers_count'),
+            author_recipes_count=F('author__recipes_count'),
+        )
+
+    def latest_per_author(self, limit=None):
+        """Оставляет не более limit последних рецептов каждого автора.
+
+        Номера строк считаются оконной функцией ROW_NUMBER() внутри
+        текущего набора, поэтому его стоит заранее ограничить авторами.
+        """
+        if limit is None:
+            return self
+        ranked = self.annotate(row_number=Window(
+            RowNumber(),
+            partition_by=F('author_id'),
+            order_by=F('id').desc(),
+        )).values('id', 'row_number')
+        sql, params = ranked.query.sql_with_params()
+        return self.filter(pk__in=RawSQL(
+            f'SELECT ranked.id FROM ({sql}) ranked '
+            'WHERE ranked.row_number <= %s',
+            (*params, limit)
+        ))
+
+
 class Recipes(models.Model):
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         verbose_name='автор',
-        related_name='recipe'
+        related_name='recipe',
+        db_index=False
     )
     name = models.CharField(
         'Название',
@@ -57,6 +131,12 @@ class Recipes(models.Model):
         'Изображение рецепта',
         upload_to='recipes/images/'
     )
+    image_variants = models.JSONField(
+        'Уменьшенные копии изображения',
+        default=dict,
+        blank=True,
+        editable=False
+    )
     text = models.TextField('Описание')
     cooking_time = models.PositiveSmallIntegerField(
         "Время приготовления",
@@ -81,11 +161,25 @@ class Recipes(models.Model):
         verbose_name='Теги',
         related_name='recipe'
     )
+    favorites_count = models.PositiveIntegerField(
+        'Добавлений в избранное', default=0, editable=False)
+    in_carts_count = models.PositiveIntegerField(
+        'Добавлений в корзину', default=0, editable=False)
+    search_vector = SearchVectorField(null=True, editable=False)
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True)
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['-id']
+        indexes = [
+            models.Index(
+                fields=('author', '-id'),
+                name='recipe_author_id_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -95,7 +189,8 @@ class IngredientInRecipe(models.Model):
     recipe = models.ForeignKey(
         Recipes,
         on_delete=models.CASCADE,
-        related_name='ingredient_list'
+        related_name='ingredient_list',
+        db_index=False
     )
     ingredient = models.ForeignKey(
         Ingredient,
@@ -128,15 +223,20 @@ class Favorite(models.Model):
         Recipes,
         on_delete=models.CASCADE,
         verbose_name='Рецпет',
-        related_name='favorite'
+        related_name='favorite',
+        db_index=False
     )
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         verbose_name='Пользователь',
-        related_name='favorite'
+        related_name='favorite',
+        db_index=False
     )
 
+    # Счётчик в Recipes, который поддерживается при добавлении и удалении.
+    counter_field = 'favorites_count'
+
     class Meta:
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
@@ -146,6 +246,12 @@ class Favorite(models.Model):
                 name='unique_author_favorite'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=('author', 'recipe'),
+                name='favorite_author_recipe_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'{self.author} добавил {self.recipe} в избранное!'
@@ -156,7 +262,8 @@ class ShopCart(models.Model):
         User,
         on_delete=models.CASCADE,
         related_name='shop',
-        verbose_name='Пользователь'
+        verbose_name='Пользователь',
+        db_index=False
     )
     recipe = models.ForeignKey(
         Recipes,
@@ -165,6 +272,8 @@ class ShopCart(models.Model):
         verbose_name='Рецепт'
     )
 
+    counter_field = 'in_carts_count'
+
     class Meta:
         verbose_name = 'Корзина покупок'
         verbose_name_plural = 'Корзина покупок'
@@ -177,3 +286,35 @@ class ShopCart(models.Model):
 
     def __str__(self):
         return f'{self.author} добавил "{self.recipe}" в Корзину покупок.'
+
+
+class ShoppingListItem(models.Model):
+    """Строка списка покупок: сколько ингредиента нужно на все рецепты
+    в корзине пользователя. Поддерживается recipes.shopping_list."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь',
+        db_index=False
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент'
+    )
+    amount = models.IntegerField('Количество')
+
+    class Meta:
+        verbose_name = 'Строка списка покупок'
+        verbose_name_plural = 'Списки покупок'
+        constraints = [
+            UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_shopping_list_item'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient} {self.amount}'
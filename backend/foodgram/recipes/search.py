@@ -0,0 +1,178 @@
+"""Поиск ингредиентов для автодополнения.
+
+Результаты ранжируются так: сначала совпадения по началу названия, затем
+по подстроке, последними — нечёткие совпадения (опечатки) по триграммам.
+На PostgreSQL поиск опирается на GIN-индексы pg_trgm, на остальных базах
+(SQLite в тестах) — на индекс в памяти процесса.
+"""
+from bisect import bisect_left
+from threading import Lock
+
+from django.db import connection, connections
+from django.db.models import Case, IntegerField, Value, When
+
+from recipes import constants
+from recipes.models import Ingredient
+
+TRIGRAM_INDEXES_SQL = (
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_upper_trgm '
+    'ON recipes_ingredient USING gin (UPPER(name::text) gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_trgm '
+    'ON recipes_ingredient USING gin (name gin_trgm_ops)',
+)
+
+
+def trigrams(text):
+    """Множество триграмм строки по правилам pg_trgm."""
+    result = set()
+    for word in ''.join(
+        char if char.isalnum() else ' ' for char in text.lower()
+    ).split():
+        padded = f'  {word} '
+        result.update(
+            padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def similarity(first, second):
+    if not first or not second:
+        return 0
+    return len(first & second) / len(first | second)
+
+
+class IngredientSearchIndex:
+    """Индекс названий ингредиентов в памяти.
+
+    Хранит отсортированный список названий для поиска по префиксу
+    и обратный индекс триграмм для поиска по подстроке и с опечатками.
+    Перестраивается лениво после invalidate().
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._entries = None
+        self._keys = None
+        self._postings = None
+
+    def invalidate(self):
+        with self._lock:
+            self._entries = None
+
+    def _build(self):
+        entries = sorted(
+            (name.lower(), pk)
+            for pk, name in Ingredient.objects.values_list('pk', 'name')
+        )
+        postings = {}
+        for position, (name, _) in enumerate(entries):
+            for trigram in trigrams(name):
+                postings.setdefault(trigram, set()).add(position)
+        self._keys = [name for name, _ in entries]
+        self._postings = postings
+        self._entries = entries
+
+    def search(self, query, limit):
+        with self._lock:
+            if self._entries is None:
+                self._build()
+            entries, keys, postings = (
+                self._entries, self._keys, self._postings)
+        query = query.lower()
+        found = []
+        seen = set()
+
+        position = bisect_left(keys, query)
+        while (position < len(keys) and keys[position].startswith(query)
+               and len(found) < limit):
+            found.append(entries[position][1])
+            seen.add(position)
+            position += 1
+        if len(found) == limit:
+            return found
+
+        query_trigrams = trigrams(query)
+        candidates = set()
+        for trigram in query_trigrams:
+            candidates |= postings.get(trigram, set())
+        candidates -= seen
+
+        if len(query) < 3:
+            # Триграммы короткого запроса — с пробелами по краям, по ним
+            # не найти подстроку в середине слова. icontains на PostgreSQL
+            # находит, поэтому названия просматриваются подряд.
+            substring_candidates = range(len(keys))
+        else:
+            substring_candidates = sorted(candidates)
+        for position in substring_candidates:
+            if position in seen:
+                continue
+            if query in keys[position]:
+                found.append(entries[position][1])
+                seen.add(position)
+                if len(found) == limit:
+                    return found
+
+        fuzzy = []
+        for position in candidates - seen:
+            score = similarity(query_trigrams, trigrams(keys[position]))
+            if score >= constants.INGREDIENT_SEARCH_SIMILARITY:
+                fuzzy.append((-score, keys[position], entries[position][1]))
+        fuzzy.sort()
+        found.extend(pk for _, _, pk in fuzzy[:limit - len(found)])
+        return found
+
+
+search_index = IngredientSearchIndex()
+
+
+def _search_postgres(query, limit):
+    from django.contrib.postgres.search import TrigramSimilarity
+
+    found = list(
+        Ingredient.objects.filter(name__icontains=query).annotate(
+            rank=Case(
+                When(name__istartswith=query, then=Value(0)),
+                default=Value(1),
+                output_field=IntegerField(),
+            )
+        ).order_by('rank', 'name').values_list('pk', flat=True)[:limit]
+    )
+    if len(found) < limit:
+        found.extend(
+            Ingredient.objects.filter(name__trigram_similar=query).exclude(
+                pk__in=found
+            ).annotate(
+                similarity=TrigramSimilarity('name', query)
+            ).order_by('-similarity', 'name').values_list(
+                'pk', flat=True)[:limit - len(found)]
+        )
+    return found
+
+
+def search_ingredients(queryset, query,
+                       limit=constants.INGREDIENT_SEARCH_LIMIT):
+    """Возвращает не более limit ингредиентов в порядке релевантности."""
+    query = query.strip()
+    if not query:
+        return queryset.none()
+    if connection.vendor == 'postgresql':
+        found = _search_postgres(query, limit)
+    else:
+        found = search_index.search(query, limit)
+    if not found:
+        return queryset.none()
+    return queryset.filter(pk__in=found).order_by(Case(
+        *[When(pk=pk, then=Value(rank)) for rank, pk in enumerate(found)],
+        output_field=IntegerField(),
+    ))
+
+
+def create_trigram_indexes(using='default', **kwargs):
+    """Создаёт расширение pg_trgm и индексы для поиска ингредиентов."""
+    db = connections[using]
+    if db.vendor != 'postgresql':
+        return
+    with db.cursor() as cursor:
+        for sql in TRIGRAM_INDEXES_SQL:
+            cursor.execute(sql)
@@ -0,0 +1,121 @@
+"""Материализованные списки покупок.
+
+ShoppingListItem хранит для каждого пользователя сумму каждого
+ингредиента по рецептам в его корзине. Таблица меняется инкрементально:
+при добавлении рецепта в корзину его ингредиенты прибавляются, при
+удалении — вычитаются, а при изменении состава рецепта он вычитается
+из всех списков со старым составом и прибавляется с новым. Поэтому
+список и выгрузка читают по строке на ингредиент, а не агрегируют
+ингредиенты всех рецептов корзины.
+
+Админка корзины и состава рецептов поддерживает списки так же, как
+API. Корзины, появившиеся до материализации или изменённые в обход
+этих путей (например, сырым SQL), пересчитывает команда
+rebuild_shopping_lists; при развёртывании она выполняется после
+миграций.
+"""
+from django.db import connections, transaction
+
+from recipes.models import IngredientInRecipe, ShopCart, ShoppingListItem
+
+ITEMS = ShoppingListItem._meta.db_table
+PARTS = IngredientInRecipe._meta.db_table
+CARTS = ShopCart._meta.db_table
+
+
+def contributions(recipe_ids, user_id=None):
+    """SELECT с вкладом рецептов в списки: (owner, ingredient_id, total).
+
+    С user_id — в список этого пользователя, без него — в списки всех,
+    у кого рецепты лежат в корзине.
+    """
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    if user_id is None:
+        return (
+            f'SELECT cart.author_id AS owner, part.ingredient_id, '
+            f'SUM(part.amount) AS total '
+            f'FROM {PARTS} part JOIN {CARTS} cart '
+            f'ON cart.recipe_id = part.recipe_id '
+            f'WHERE part.recipe_id IN ({placeholders}) '
+            f'GROUP BY cart.author_id, part.ingredient_id',
+            list(recipe_ids)
+        )
+    return (
+        f'SELECT %s AS owner, part.ingredient_id, '
+        f'SUM(part.amount) AS total '
+        f'FROM {PARTS} part WHERE part.recipe_id IN ({placeholders}) '
+        f'GROUP BY part.ingredient_id',
+        [user_id, *recipe_ids]
+    )
+
+
+def add_recipes(recipe_ids, user_id=None, using='default'):
+    """Прибавляет ингредиенты рецептов к спискам покупок."""
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+    select, params = contributions(recipe_ids, user_id)
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {ITEMS} (user_id, ingredient_id, amount) '
+            f'{select} '
+            f'ON CONFLICT (user_id, ingredient_id) DO UPDATE '
+            f'SET amount = {ITEMS}.amount + excluded.amount',
+            params
+        )
+
+
+def remove_recipes(recipe_ids, user_id=None, using='default'):
+    """Вычитает ингредиенты рецептов из списков покупок.
+
+    Без user_id рецепты ещё должны лежать в корзинах.
+    """
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return
+    select, params = contributions(recipe_ids, user_id)
+    if user_id is None:
+        placeholders = ', '.join(['%s'] * len(recipe_ids))
+        owners = (
+            f'user_id IN (SELECT author_id FROM {CARTS} '
+            f'WHERE recipe_id IN ({placeholders}))')
+        owner_params = recipe_ids
+    else:
+        owners, owner_params = 'user_id = %s', [user_id]
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {ITEMS} SET amount = {ITEMS}.amount - change.total '
+            f'FROM ({select}) change '
+            f'WHERE change.owner = {ITEMS}.user_id '
+            f'AND change.ingredient_id = {ITEMS}.ingredient_id',
+            params
+        )
+        cursor.execute(
+            f'DELETE FROM {ITEMS} WHERE {owners} AND amount <= 0',
+            owner_params
+        )
+
+
+def rebuild(user_ids=None, using='default'):
+    """Пересчитывает списки покупок по корзинам с нуля."""
+    items = ShoppingListItem.objects.using(using)
+    condition, params = '', []
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        items = items.filter(user__in=user_ids)
+        placeholders = ', '.join(['%s'] * len(user_ids)) or 'NULL'
+        condition = f'WHERE cart.author_id IN ({placeholders}) '
+        params = user_ids
+    with transaction.atomic(using):
+        items.delete()
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {ITEMS} (user_id, ingredient_id, amount) '
+                f'SELECT cart.author_id, part.ingredient_id, '
+                f'SUM(part.amount) '
+                f'FROM {CARTS} cart JOIN {PARTS} part '
+                f'ON part.recipe_id = cart.recipe_id '
+                f'{condition}'
+                f'GROUP BY cart.author_id, part.ingredient_id',
+                params
+            )
@@ -0,0 +1,85 @@
+from django.db import connections, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from recipes.fulltext import remove_from_sqlite_index, update_search_index
+from recipes.images import delete_variant_files
+from recipes.models import Ingredient, Recipes, Tags
+from recipes.search import search_index
+from recipes.shopping_list import remove_recipes
+from recipes.toggles import LINKS, adjust_counters
+from users.models import User
+
+# Отправляется после массовых изменений ингредиентов в обход save().
+ingredients_imported = Signal()
+
+
+@receiver((post_save, post_delete, ingredients_imported), sender=Ingredient)
+def invalidate_ingredient_search(**kwargs):
+    search_index.invalidate()
+
+
+@receiver(post_save, sender=Ingredient)
+def update_recipes_search_index(instance, created, **kwargs):
+    if not created:
+        update_search_index(
+            instance.recipes.values_list('pk', flat=True))
+        instance.recipes.update(updated_at=timezone.now())
+
+
+@receiver(pre_delete, sender=Ingredient)
+def touch_recipes_with_ingredient(instance, **kwargs):
+    instance.recipes.update(updated_at=timezone.now())
+
+
+@receiver((post_save, pre_delete), sender=Tags)
+def touch_tagged_recipes(instance, created=False, **kwargs):
+    if not created:
+        instance.recipe.update(updated_at=timezone.now())
+
+
+@receiver(post_delete, sender=Recipes)
+def remove_recipe_from_search_index(instance, using, **kwargs):
+    if connections[using].vendor == 'sqlite':
+        with connections[using].cursor() as cursor:
+            remove_from_sqlite_index(cursor, [instance.pk])
+
+
+@receiver(pre_delete, sender=Recipes)
+def remove_recipe_from_shopping_lists(instance, using, **kwargs):
+    remove_recipes([instance.pk], using=using)
+
+
+@receiver(post_delete, sender=Recipes)
+def delete_recipe_image_variants(instance, **kwargs):
+    names = list(instance.image_variants.values())
+    if names:
+        transaction.on_commit(lambda: delete_variant_files(names))
+
+
+def change_recipes_count(author_id, delta, using):
+    User.objects.using(using).filter(pk=author_id).update(
+        recipes_count=Greatest(F('recipes_count') + delta, 0))
+
+
+@receiver(post_save, sender=Recipes)
+def count_created_recipe(instance, created, raw, using, **kwargs):
+    if created and not raw:
+        change_recipes_count(instance.author_id, 1, using)
+
+
+@receiver(post_delete, sender=Recipes)
+def count_deleted_recipe(instance, using, **kwargs):
+    change_recipes_count(instance.author_id, -1, using)
+
+
+@receiver(pre_delete, sender=User)
+def uncount_user_links(instance, using, **kwargs):
+    """Связи удаляемого пользователя уходят каскадом мимо remove_link."""
+    for model, (owner, target) in LINKS.items():
+        adjust_counters(model, model.objects.using(using).filter(
+            **{f'{owner}_id': instance.pk}
+        ).values_list(f'{target}_id', flat=True), -1, using)
@@ -0,0 +1,127 @@
+import shutil
+import tempfile
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+
+from django.contrib.admin.sites import site
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
+
+from recipes.management.commands.benchmark_concurrency import temporary_token
+from recipes.models import Ingredient, Recipes
+from users.models import User
+
+
+class TemporaryMediaMixin:
+    """Файлы, которые пишет generate_data, — во временном каталоге."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.media = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.media.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+
+class ExplainFiltersTests(TemporaryMediaMixin, TestCase):
+    """Горячие фильтры API обслуживаются индексами на объёме данных,
+    при котором планировщик выбирает план по статистике."""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'generate_data', users=200, recipes=2000, ingredients=(3, 8),
+            stdout=StringIO())
+
+    def test_filters_use_indexes(self):
+        output = StringIO()
+        call_command('explain_filters', analyze=True, stdout=output)
+        self.assertNotIn('полный просмотр', output.getvalue())
+
+
+class LoadCsvTests(TestCase):
+
+    def test_dry_run_counts_duplicates_across_batches_once(self):
+        with tempfile.NamedTemporaryFile(
+                'w', suffix='.csv', encoding='utf-8') as file:
+            file.write('соль,г\nперец,г\nсоль,г\nсоль,г\nперец,г\n')
+            file.flush()
+            dry_run = StringIO()
+            call_command('load_csv', file.name, batch_size=2, dry_run=True,
+                         stdout=dry_run)
+            self.assertFalse(Ingredient.objects.exists())
+            call_command('load_csv', file.name, batch_size=2,
+                         stdout=StringIO())
+        self.assertIn('Будет добавлено: 2 из 5', dry_run.getvalue())
+        self.assertEqual(Ingredient.objects.count(), 2)
+
+
+class RecipeAdminTests(TestCase):
+
+    def test_image_change_replaces_variants(self):
+        user = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Имя', last_name='Фамилия', password='password')
+        recipe = Recipes.objects.create(
+            author=user, name='Рецепт', text='Описание', cooking_time=10,
+            image='recipes/images/old.png',
+            image_variants={'320': 'recipes/images/old_320.webp'})
+        recipe.image = 'recipes/images/new.png'
+        with mock.patch('recipes.admin.schedule_image_variants') as schedule, \
+                mock.patch('recipes.admin.delete_variant_files') as delete, \
+                self.captureOnCommitCallbacks(execute=True):
+            site._registry[Recipes].save_model(
+                None, recipe, SimpleNamespace(changed_data=['image']), True)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_variants, {})
+        schedule.assert_called_once_with(recipe)
+        delete.assert_called_once_with(['recipes/images/old_320.webp'])
+
+
+class GenerateDataTests(TemporaryMediaMixin, TestCase):
+
+    def generate(self, **options):
+        call_command(
+            'generate_data', users=3, recipes=5, ingredients=(1, 2),
+            prefix='bench', stdout=StringIO(), **options)
+
+    def test_clear_keeps_real_users_with_prefix(self):
+        real = User.objects.create_user(
+            email='bench@example.com', username='benchmark_fan',
+            first_name='Имя', last_name='Фамилия', password='password')
+        self.generate()
+        self.generate(clear=True)
+        self.assertTrue(User.objects.filter(pk=real.pk).exists())
+        self.assertEqual(
+            User.objects.filter(username__startswith='bench').count(), 4)
+
+    def test_refuses_taken_usernames(self):
+        User.objects.create_user(
+            email='bench1@example.com', username='bench1',
+            first_name='Имя', last_name='Фамилия', password='password')
+        with self.assertRaises(CommandError):
+            self.generate(clear=True)
+
+
+class BenchmarkTokenTests(TestCase):
+
+    def test_created_token_is_removed(self):
+        user = User.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='Имя', last_name='Фамилия', password='password')
+        with temporary_token(user):
+            self.assertTrue(Token.objects.filter(user=user).exists())
+        self.assertFalse(Token.objects.filter(user=user).exists())
+        existing = Token.objects.create(user=user)
+        with temporary_token(user) as token:
+            self.assertEqual(token, existing)
+        self.assertTrue(Token.objects.filter(pk=existing.pk).exists())
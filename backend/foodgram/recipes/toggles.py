@@ -0,0 +1,285 @@
+"""Добавление и удаление связей пользователя: избранное, корзина,
+подписки.
+
+На PostgreSQL каждая операция — один запрос: проверка объекта, вставка
+с ON CONFLICT DO NOTHING (или DELETE ... RETURNING) и пересчёт счётчика
+объекта выполняются в цепочке CTE; счётчик при уменьшении не опускается
+ниже нуля, даже если разошёлся с данными. Повторный запрос или двойной клик
+не приводит к IntegrityError: конфликт просто означает «уже добавлено».
+Отметку updated_at объекта счётчики не трогают: от неё зависят общие
+кэши представлений, а свежие счётчики накладываются при выдаче.
+На остальных базах то же делается несколькими запросами в транзакции.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from recipes.models import Favorite, ShopCart
+from users.models import Follow
+
+# Модель связи: поле владельца и поле объекта, у которого есть счётчик
+# model.counter_field.
+LINKS = {
+    Favorite: ('author', 'recipe'),
+    ShopCart: ('author', 'recipe'),
+    Follow: ('user', 'author'),
+}
+
+
+def describe(model, using):
+    """Имена таблиц и столбцов связи, готовые к подстановке в SQL."""
+    quote = connections[using].ops.quote_name
+    owner, target = (model._meta.get_field(name) for name in LINKS[model])
+    target_model = target.related_model
+    return target_model, {
+        'table': quote(model._meta.db_table),
+        'owner': quote(owner.column),
+        'target': quote(target.column),
+        'target_table': quote(target_model._meta.db_table),
+        'pk': quote(target_model._meta.pk.column),
+        'counter': quote(
+            target_model._meta.get_field(model.counter_field).column),
+    }
+
+
+def from_row(model, fields, values, using):
+    """Экземпляр model из столбцов fields, прочитанных сырым SQL."""
+    connection = connections[using]
+    row = {}
+    for name, value in zip(fields, values):
+        field = model._meta.get_field(name)
+        if hasattr(field, 'from_db_value'):
+            value = field.from_db_value(value, None, connection)
+        row[field.attname] = value
+    # from_db() ждёт значения в порядке полей модели.
+    names = [field.attname for field in model._meta.concrete_fields
+             if field.attname in row]
+    return model.from_db(using, names, [row[name] for name in names])
+
+
+def add_link(model, owner_id, target_id, fields=('id',), using='default'):
+    """Создаёт связь владельца с объектом.
+
+    Возвращает (объект с полями fields или None, если его нет; создана ли
+    связь). Счётчик объекта увеличивается, только если связь создана.
+    """
+    target_model, names = describe(model, using)
+    if connections[using].vendor != 'postgresql':
+        return _add_link_fallback(
+            model, target_model, owner_id, target_id, fields, using)
+    quote = connections[using].ops.quote_name
+    columns = ', '.join(
+        quote(target_model._meta.get_field(name).column) for name in fields)
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'WITH target AS ('
+            f'  SELECT {columns} FROM {names["target_table"]}'
+            f'  WHERE {names["pk"]} = %s'
+            f'), inserted AS ('
+            f'  INSERT INTO {names["table"]} ({names["owner"]},'
+            f'  {names["target"]})'
+            f'  SELECT %s, {names["pk"]} FROM {names["target_table"]}'
+            f'  WHERE {names["pk"]} = %s'
+            f'  ON CONFLICT DO NOTHING RETURNING {names["target"]}'
+            f'), counted AS ('
+            f'  UPDATE {names["target_table"]}'
+            f'  SET {names["counter"]} = {names["counter"]} + 1'
+            f'  WHERE {names["pk"]} IN'
+            f'  (SELECT {names["target"]} FROM inserted)'
+            f'  RETURNING {names["pk"]}'
+            f') SELECT EXISTS (SELECT 1 FROM counted), {columns} FROM target',
+            (target_id, owner_id, target_id)
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return None, False
+    return from_row(target_model, fields, row[1:], using), row[0]
+
+
+def _add_link_fallback(model, target_model, owner_id, target_id, fields,
+                       using):
+    owner, target = LINKS[model]
+    with transaction.atomic(using):
+        instance = target_model.objects.using(using).filter(
+            pk=target_id).only(*fields).first()
+        if instance is None:
+            return None, False
+        try:
+            with transaction.atomic(using):
+                model.objects.using(using).create(
+                    **{f'{owner}_id': owner_id, target: instance})
+        except IntegrityError:
+            return instance, False
+        target_model.objects.using(using).filter(pk=target_id).update(**{
+            model.counter_field: F(model.counter_field) + 1})
+    return instance, True
+
+
+def remove_link(model, owner_id, target_id, using='default'):
+    """Удаляет связь владельца с объектом.
+
+    Возвращает (существует ли объект; удалена ли связь).
+    """
+    target_model, names = describe(model, using)
+    if connections[using].vendor != 'postgresql':
+        return _remove_link_fallback(
+            model, target_model, owner_id, target_id, using)
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'WITH deleted AS ('
+            f'  DELETE FROM {names["table"]}'
+            f'  WHERE {names["owner"]} = %s AND {names["target"]} = %s'
+            f'  RETURNING {names["target"]}'
+            f'), counted AS ('
+            f'  UPDATE {names["target_table"]}'
+            f'  SET {names["counter"]} = GREATEST({names["counter"]} - 1, 0)'
+            f'  WHERE {names["pk"]} IN'
+            f'  (SELECT {names["target"]} FROM deleted)'
+            f'  RETURNING {names["pk"]}'
+            f') SELECT EXISTS (SELECT 1 FROM {names["target_table"]}'
+            f'  WHERE {names["pk"]} = %s), EXISTS (SELECT 1 FROM counted)',
+            (owner_id, target_id, target_id)
+        )
+        return cursor.fetchone()
+
+
+def _remove_link_fallback(model, target_model, owner_id, target_id, using):
+    owner, target = LINKS[model]
+    with transaction.atomic(using):
+        deleted, _ = model.objects.using(using).filter(
+            **{f'{owner}_id': owner_id, f'{target}_id': target_id}
+        ).delete()
+        if not deleted:
+            return target_model.objects.using(using).filter(
+                pk=target_id).exists(), False
+        adjust_counters(model, [target_id], -deleted, using)
+    return True, True
+
+
+def add_links(model, owner_id, target_ids, using='default'):
+    """Пакетный вариант add_link.
+
+    Возвращает (id существующих объектов из target_ids; id объектов,
+    для которых связь создана).
+    """
+    target_model, names = describe(model, using)
+    target_ids = list(target_ids)
+    if connections[using].vendor != 'postgresql':
+        return _add_links_fallback(
+            model, target_model, owner_id, target_ids, using)
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'WITH inserted AS ('
+            f'  INSERT INTO {names["table"]} ({names["owner"]},'
+            f'  {names["target"]})'
+            f'  SELECT %s, {names["pk"]} FROM {names["target_table"]}'
+            f'  WHERE {names["pk"]} = ANY(%s)'
+            f'  ON CONFLICT DO NOTHING RETURNING {names["target"]}'
+            f'), counted AS ('
+            f'  UPDATE {names["target_table"]}'
+            f'  SET {names["counter"]} = {names["counter"]} + 1'
+            f'  WHERE {names["pk"]} IN'
+            f'  (SELECT {names["target"]} FROM inserted)'
+            f'  RETURNING {names["pk"]}'
+            f') SELECT {names["pk"]},'
+            f'  {names["pk"]} IN (SELECT {names["pk"]} FROM counted)'
+            f'  FROM {names["target_table"]} WHERE {names["pk"]} = ANY(%s)',
+            (owner_id, target_ids, target_ids)
+        )
+        rows = cursor.fetchall()
+    return {pk for pk, _ in rows}, {pk for pk, created in rows if created}
+
+
+def _add_links_fallback(model, target_model, owner_id, target_ids, using):
+    owner, target = LINKS[model]
+    with transaction.atomic(using):
+        found = set(target_model.objects.using(using).filter(
+            pk__in=target_ids).values_list('pk', flat=True))
+        created = found - set(model.objects.using(using).filter(
+            **{f'{owner}_id': owner_id, f'{target}__in': found}
+        ).values_list(f'{target}_id', flat=True))
+        model.objects.using(using).bulk_create(
+            [model(**{f'{owner}_id': owner_id, f'{target}_id': pk})
+             for pk in created],
+            ignore_conflicts=True,
+        )
+        target_model.objects.using(using).filter(pk__in=created).update(**{
+            model.counter_field: F(model.counter_field) + 1})
+    return found, created
+
+
+def remove_links(model, owner_id, target_ids=None, using='default'):
+    """Пакетный вариант remove_link; без target_ids удаляет все связи
+    владельца.
+
+    Возвращает (id существующих объектов из target_ids или удалённых,
+    если target_ids не передан; id объектов, связь с которыми удалена).
+    """
+    target_model, names = describe(model, using)
+    if target_ids is not None:
+        target_ids = list(target_ids)
+    if connections[using].vendor != 'postgresql':
+        return _remove_links_fallback(
+            model, target_model, owner_id, target_ids, using)
+    condition = ''
+    params = [owner_id]
+    if target_ids is not None:
+        condition = f' AND {names["target"]} = ANY(%s)'
+        params.append(target_ids)
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f'WITH deleted AS ('
+            f'  DELETE FROM {names["table"]}'
+            f'  WHERE {names["owner"]} = %s{condition}'
+            f'  RETURNING {names["target"]}'
+            f'), counted AS ('
+            f'  UPDATE {names["target_table"]}'
+            f'  SET {names["counter"]} = GREATEST({names["counter"]} - 1, 0)'
+            f'  WHERE {names["pk"]} IN'
+            f'  (SELECT {names["target"]} FROM deleted)'
+            f'  RETURNING {names["pk"]}'
+            f') SELECT {names["pk"]},'
+            f'  {names["pk"]} IN (SELECT {names["pk"]} FROM counted)'
+            f'  FROM {names["target_table"]} WHERE {names["pk"]} = ANY(%s)'
+            f'  OR {names["pk"]} IN (SELECT {names["pk"]} FROM counted)',
+            (*params, target_ids or [])
+        )
+        rows = cursor.fetchall()
+    return {pk for pk, _ in rows}, {pk for pk, removed in rows if removed}
+
+
+def _remove_links_fallback(model, target_model, owner_id, target_ids,
+                           using):
+    owner, target = LINKS[model]
+    with transaction.atomic(using):
+        links = model.objects.using(using).filter(**{f'{owner}_id': owner_id})
+        if target_ids is not None:
+            links = links.filter(**{f'{target}__in': target_ids})
+        removed = set(links.values_list(f'{target}_id', flat=True))
+        links.filter(**{f'{target}__in': removed}).delete()
+        adjust_counters(model, removed, -1, using)
+        if target_ids is None:
+            return removed, removed
+        found = set(target_model.objects.using(using).filter(
+            pk__in=target_ids).values_list('pk', flat=True))
+    return found, removed
+
+
+def adjust_counters(model, target_ids, delta, using='default'):
+    """Меняет счётчик model.counter_field объектов на delta за каждое
+    вхождение id в target_ids.
+
+    Для связей, созданных или удалённых в обход add_link и remove_link
+    (админка, каскадное удаление). Счётчик не опускается ниже нуля, даже
+    если он разошёлся с данными до пересчёта reconcile_counters.
+    """
+    target_model = model._meta.get_field(LINKS[model][1]).related_model
+    by_count = {}
+    for target_id, count in Counter(target_ids).items():
+        by_count.setdefault(count, []).append(target_id)
+    for count, ids in by_count.items():
+        target_model.objects.using(using).filter(pk__in=ids).update(**{
+            model.counter_field: Greatest(
+                F(model.counter_field) + delta * count, 0)})
@@ -1,14 +1,16 @@
 from django.contrib import admin
 
 from .models import Follow, User
+from recipes.admin import LinkAdmin
 
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
-    list_display = ('id', 'username', 'email', 'first_name', 'last_name')
+    list_display = ('id', 'username', 'email', 'first_name', 'last_name',
+                    'followers_count', 'recipes_count')
     list_filter = ('email', 'first_name')
 
 
 @admin.register(Follow)
-class SubscribeAdmin(admin.ModelAdmin):
+class SubscribeAdmin(LinkAdmin):
     list_display = ('user', 'author')
@@ -1,15 +1,38 @@
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
 from django.db import models
+from django.db.models import BooleanField, Exists, OuterRef, Value
+
+
+class UserQuerySet(models.QuerySet):
+
+    def with_is_subscribed(self, user):
+        """Аннотирует авторов флагом подписки текущего пользователя."""
+        if user.is_anonymous:
+            return self.annotate(
+                is_subscribed=Value(False, output_field=BooleanField()))
+        return self.annotate(is_subscribed=Exists(
+            Follow.objects.filter(user=user, author=OuterRef('pk'))))
+
+
+class CustomUserManager(UserManager.from_queryset(UserQuerySet)):
+    ...
 
 
 class User(AbstractUser):
     email = models.EmailField('Email', max_length=200, unique=True)
     first_name = models.CharField('Имя', max_length=150)
     last_name = models.CharField('Фамилия', max_length=150)
+    followers_count = models.PositiveIntegerField(
+        'Подписчиков', default=0, editable=False)
+    recipes_count = models.PositiveIntegerField(
+        'Рецептов', default=0, editable=False)
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ('username', 'first_name', 'last_name',)
 
+    objects = CustomUserManager()
+
     class Meta:
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
@@ -24,6 +47,7 @@ class Follow(models.Model):
         on_delete=models.CASCADE,
         related_name='follower',
         verbose_name='Подписчик',
+        db_index=False,
     )
 
     author = models.ForeignKey(
@@ -33,6 +57,9 @@ class Follow(models.Model):
         verbose_name='Автор',
     )
 
+    # Счётчик в User, который поддерживается при подписке и отписке.
+    counter_field = 'followers_count'
+
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'